@@ -0,0 +1,67 @@
+"""Benchmark casting parsed rows into a typed DataFrame."""
+
+import time
+import json
+import pandas as pd
+from nine_ninety.scrape.utils import DATA_TYPES, parse, to_frame, cast_row
+from nine_ninety.bench.synthetic import make_filings
+
+
+def legacy_cast(rows):
+  """Reference implementation casting bools with a python lambda per value."""
+  df = pd.DataFrame(rows)
+  types = {'int': int, 'str': str, 'float': float,
+           'bool': lambda x: 1 if x in ('1', 'true') else 0}
+  for k in df.columns:
+    type_as_string = DATA_TYPES[k]
+    type_literal = types[type_as_string]
+    if type_as_string == 'bool':
+      df[k] = df[k].apply(type_literal)
+    else:
+      df[k] = df[k].astype(type_literal)
+  return df
+
+
+def make_rows(n, n_distinct=1000, cast=False):
+  """Return n parsed rows, repeating n_distinct rows from synthetic filings.
+
+  Every row is a distinct object, as when read back from the journal, and
+  cast as parser processes do if cast is True."""
+  base = [parse(xml) for xml in make_filings(min(n, n_distinct))]
+  if cast:
+    base = [cast_row(row) for row in base]
+  encoded = [json.dumps(row) for row in base]
+  return [json.loads(encoded[i % len(encoded)]) for i in range(n)]
+
+
+def time_cast(func, rows):
+  """Return seconds taken by func to cast rows."""
+  start = time.perf_counter()
+  func(rows)
+  return time.perf_counter() - start
+
+
+def run_benchmark(sizes=(1000, 200000)):
+  """Check the casts agree and print their timings for each batch size.
+
+  The legacy cast and to_frame are timed on raw rows, and to_frame again on
+  rows already cast by the parser processes."""
+  for n in sizes:
+    print(f'Building {n} parsed rows ...')
+    rows = make_rows(n)
+    cast_rows = make_rows(n, cast=True)
+    if n <= 10000:
+      expected = legacy_cast(rows)
+      actual = to_frame(rows)
+      assert (expected.astype(str).values == actual.astype(str).values).all()
+      pd.testing.assert_frame_equal(actual, to_frame(cast_rows))
+
+    before = time_cast(legacy_cast, rows)
+    raw = time_cast(to_frame, rows)
+    after = time_cast(to_frame, cast_rows)
+    print(f'{n:>8} rows: legacy {before:8.3f}s, vectorized {raw:8.3f}s, '
+          f'from cast rows {after:8.3f}s, speedup {before / after:.1f}x')
+
+
+if __name__ == '__main__':
+  run_benchmark()
@@ -0,0 +1,57 @@
+"""Micro-benchmark the time spent parsing a single filing."""
+
+import time
+from lxml import etree
+from nine_ninety.scrape.utils import parse, parse_officers
+from nine_ninety.scrape.utils import NEW_PATHS, OLD_PATHS
+from nine_ninety.bench.synthetic import make_filings
+
+
+def legacy_parse(xml):
+  """Reference implementation calling find once per xpath string."""
+  data = {}
+  root = etree.XML(xml)
+  version_year = int(root.attrib['returnVersion'].split('v')[0])
+  paths = OLD_PATHS if version_year < 2013 else NEW_PATHS
+  for k, p in paths.items():
+    try:
+      if version_year == 2013 and k == 'organization_name':
+        p = p[:-3]
+      data[k] = root.find(p, namespaces=root.nsmap).text
+    except AttributeError:
+      data[k] = 0
+  data.update(parse_officers(root, version_year))
+  return data
+
+
+def time_per_filing(func, filings, repeat=5):
+  """Return the best time in microseconds for func to handle one filing."""
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    for xml in filings:
+      func(xml)
+    best = min(best, time.perf_counter() - start)
+  return 1e6 * best / len(filings)
+
+
+def run_benchmark(n=500, **kwargs):
+  """Check parsers agree on synthetic filings and print their timings."""
+  print(f'Building {n} synthetic filings ...')
+  filings = make_filings(n, **kwargs)
+  for xml in filings:
+    assert parse(xml) == legacy_parse(xml)
+    assert parse(xml, streaming=True) == legacy_parse(xml)
+
+  before = time_per_filing(legacy_parse, filings)
+  after = time_per_filing(parse, filings)
+  streaming = time_per_filing(lambda xml: parse(xml, streaming=True), filings)
+  print(f'legacy find per xpath: {before:8.1f} µs per filing')
+  print(f'compiled path tree:    {after:8.1f} µs per filing')
+  print(f'streaming events:      {streaming:8.1f} µs per filing')
+  print(f'speedup: {before / after:.2f}x')
+  return {'legacy': before, 'compiled': after, 'streaming': streaming}
+
+
+if __name__ == '__main__':
+  run_benchmark()
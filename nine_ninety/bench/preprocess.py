@@ -0,0 +1,107 @@
+"""Benchmark scaling the cleaned data before modeling."""
+
+import time
+import numpy as np
+import pandas as pd
+from nine_ninety.scrape.utils import DATA_TYPES
+from nine_ninety.models.preprocess import get_numeric_keys, get_ratio_keys
+from nine_ninety.models.preprocess import scale_founded_year, include_ratios
+from nine_ninety.models.preprocess import log_scale
+
+
+def legacy_scale_founded_year(df):
+  """Reference implementation finding the mode with a python call per EIN."""
+  df = df.copy()
+
+  def apply_to_group(years):
+    m = years[years.between(1600, 2030)].mode().mean()
+    return 2000 if pd.isnull(m) else m
+
+  modes = df.groupby('ein')['founded_year'].apply(apply_to_group)
+  df['founded_year'] = (df['ein'].map(modes) - 2000) / 100
+  return df
+
+
+def legacy_include_ratios(df):
+  """Reference implementation dividing one pair of columns at a time."""
+  df_copy = df.copy()
+  for key1, key2 in get_ratio_keys():
+    df_copy[key1 + '_ratio'] = (df_copy[key1] / df[key2]).clip(-1, 1)
+  return df_copy.fillna(0.0)
+
+
+def legacy_log_scale(df):
+  """Reference implementation scaling one column at a time."""
+  df_copy = df.copy()
+  for key in get_numeric_keys(False):
+    x = df[key].astype('float64')
+    s = np.sign(x)
+    df_copy[key] = s * np.log(x * s + 1)
+  return df_copy
+
+
+def legacy_scale(df):
+  """Scale df as the preprocessing did before it was vectorized."""
+  return legacy_log_scale(legacy_include_ratios(legacy_scale_founded_year(df)))
+
+
+def scale(df):
+  """Scale df in place with the vectorized pipeline of scale_df."""
+  df = scale_founded_year(df, inplace=True)
+  df = include_ratios(df, inplace=True)
+  return log_scale(df, inplace=True)
+
+
+def make_frame(n, n_eins=None, seed=0):
+  """Return n rows of cleaned data with random values of every key."""
+  rng = np.random.default_rng(seed)
+  n_eins = n_eins or max(1, n // 4)
+  data = {}
+  for key, data_type in DATA_TYPES.items():
+    if data_type == 'int':
+      values = rng.integers(-10 ** 5, 10 ** 7, n)
+      values[rng.random(n) < 0.3] = 0  # many amounts are left blank
+      data[key] = values
+    elif data_type == 'float':
+      data[key] = rng.random(n).round(4)
+    elif data_type == 'bool':
+      data[key] = rng.random(n) < 0.5
+  words = np.array(['serve', 'community', 'youth', 'education', 'health'])
+  data['mission'] = [' '.join(rng.choice(words, k))
+                     for k in rng.integers(0, 20, n)]
+  data['organization_name'] = [f'Synthetic Organization {i}' for i in range(n)]
+  # ein is read as an integer, as in the cleaned data
+  data['ein'] = rng.integers(10 ** 8, 10 ** 8 + n_eins, n)
+  data['tax_year'] = rng.integers(2009, 2020, n)
+  founded_year = rng.integers(1850, 2020, n)
+  founded_year[rng.random(n) < 0.1] = 0  # implausible years are ignored
+  data['founded_year'] = founded_year
+  return pd.DataFrame(data)
+
+
+def time_scale(func, df):
+  """Return seconds taken by func to scale a copy of df."""
+  df = df.copy()
+  start = time.perf_counter()
+  func(df)
+  return time.perf_counter() - start
+
+
+def run_benchmark(sizes=(10000, 1000000)):
+  """Check both pipelines agree and print their timings for each size."""
+  for n in sizes:
+    print(f'Building {n} rows ...')
+    df = make_frame(n)
+    if n <= 100000:
+      expected = legacy_scale(df)
+      actual = scale(df.copy())
+      pd.testing.assert_frame_equal(expected, actual)
+
+    before = time_scale(legacy_scale, df)
+    after = time_scale(scale, df)
+    print(f'{n:>8} rows: legacy {before:8.3f}s, vectorized {after:8.3f}s, '
+          f'speedup {before / after:.1f}x')
+
+
+if __name__ == '__main__':
+  run_benchmark()
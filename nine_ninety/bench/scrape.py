@@ -0,0 +1,89 @@
+"""Benchmark the scraper end to end against a local mock of the S3 bucket."""
+
+import os
+import time
+import shutil
+import asyncio
+import resource
+import tempfile
+import aiohttp
+import numpy as np
+from nine_ninety.scrape import index
+from nine_ninety.scrape import scrape
+from nine_ninety.bench.server import PORT, start_server, get_base_url
+
+
+def make_trace(latencies):
+  """Return a trace appending the seconds until each response arrives."""
+  trace = aiohttp.TraceConfig()
+
+  async def on_request_start(session, context, params):
+    context.start = time.perf_counter()
+
+  async def on_request_end(session, context, params):
+    latencies.append(time.perf_counter() - context.start)
+
+  trace.on_request_start.append(on_request_start)
+  trace.on_request_end.append(on_request_end)
+  return trace
+
+
+def get_usage():
+  """Return CPU seconds used by this process and its finished children."""
+  usage = [resource.getrusage(who) for who in
+           (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+  return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def run_benchmark(n_filings=2000, years=(2016,), port=PORT, request_timeout=5,
+                  **kwargs):
+  """Scrape years from a mock bucket and print throughput and resource use.
+
+  Keyword arguments such as latency, not_found, errors and timeouts are
+  passed to the mock bucket. Requests stalled by timeouts are abandoned
+  after request_timeout seconds. Data is written to a temporary directory."""
+  data_path = tempfile.mkdtemp(prefix='nine_ninety_bench_')
+  previous = (os.environ.get('NINE_NINETY_DATA'), index.INDEX_URL,
+              scrape.TRACE_CONFIGS, scrape.REQUEST_TIMEOUT)
+  latencies = []
+  os.environ['NINE_NINETY_DATA'] = data_path
+  index.INDEX_URL = get_base_url(port)
+  scrape.TRACE_CONFIGS = [make_trace(latencies)]
+  scrape.REQUEST_TIMEOUT = request_timeout
+  kwargs.setdefault('hang', 2 * request_timeout)
+  server = start_server(port, n_filings=n_filings, **kwargs)
+  try:
+    for year in years:
+      index.get_json_index(year)
+    n = sum(index.count_index(year) for year in years)
+
+    cpu = get_usage()
+    start = time.perf_counter()
+    asyncio.run(scrape.run_years(list(years)))
+    elapsed = time.perf_counter() - start
+    cpu = get_usage() - cpu
+  finally:
+    server.terminate()
+    os.environ.pop('NINE_NINETY_DATA')
+    if previous[0] is not None:
+      os.environ['NINE_NINETY_DATA'] = previous[0]
+    index.INDEX_URL, scrape.TRACE_CONFIGS, scrape.REQUEST_TIMEOUT = previous[1:]
+    shutil.rmtree(data_path)
+
+  p50, p99 = 1000 * np.percentile(latencies, [50, 99])
+  # ru_maxrss is in kilobytes on linux
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+  child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+  results = {'filings': n, 'seconds': elapsed, 'filings_per_sec': n / elapsed,
+             'p50_ms': p50, 'p99_ms': p99, 'cpu_ms_per_filing': 1000 * cpu / n,
+             'peak_rss_mb': rss, 'peak_worker_rss_mb': child_rss}
+  print(f'scraped {n} filings in {elapsed:.1f} s')
+  print(f'throughput:        {results["filings_per_sec"]:8.1f} filings / s')
+  print(f'latency p50 / p99: {p50:8.1f} / {p99:.1f} ms')
+  print(f'cpu per filing:    {results["cpu_ms_per_filing"]:8.2f} ms')
+  print(f'peak rss:          {rss:8.1f} MB, largest worker {child_rss:.1f} MB')
+  return results
+
+
+if __name__ == '__main__':
+  run_benchmark()
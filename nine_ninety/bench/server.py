@@ -0,0 +1,138 @@
+"""Serve synthetic index files and filings in place of the AWS S3 bucket."""
+
+import time
+import socket
+import logging
+import random
+import asyncio
+import hashlib
+import functools
+import multiprocessing
+from aiohttp import web
+from nine_ninety.bench.synthetic import make_filing
+
+
+PORT = 8990
+PREFIX = '/irs-form-990'
+SCHEMA_VERSIONS = [2010, 2011, 2012, 2013, 2014, 2016, 2018]
+N_VARIANTS = 8  # distinct filings generated per schema version and tax year
+PLACEHOLDER_EIN = '999999999'  # swapped for the EIN of the requested filing
+
+
+def get_base_url(port=PORT):
+  """Return the url standing in for the S3 bucket."""
+  return f'http://127.0.0.1:{port}{PREFIX}'
+
+
+def object_hash(object_id, salt=''):
+  """Return a stable number in [0, 1) derived from object_id."""
+  digest = hashlib.sha1(f'{salt}{object_id}'.encode()).digest()
+  return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+
+def object_ein(object_id):
+  """Return the EIN filed under object_id."""
+  return f'{10 ** 8 + int(object_hash(object_id, "ein") * 9 * 10 ** 8):09}'
+
+
+def make_index(year, n_filings, port=PORT, other_forms=0.2):
+  """Return the index of year as AWS serves it, including non-990 forms."""
+  entries = []
+  for i in range(n_filings):
+    object_id = f'{year}{i:08}'
+    is_990 = object_hash(object_id, 'form') >= other_forms
+    entries.append({
+        'EIN': object_ein(object_id),
+        'TaxPeriod': f'{year - 1}12',
+        'DLN': f'9349{object_id}',
+        'FormType': '990' if is_990 else '990EZ',
+        'URL': f'{get_base_url(port)}/{object_id}_public.xml',
+        'OrganizationName': f'SYNTHETIC ORGANIZATION {i}',
+        'SubmittedOn': f'{year}-06-30',
+        'ObjectId': object_id,
+        'LastUpdated': f'{year}-12-31T00:00:00'})
+  return {f'Filings{year}': entries}
+
+
+@functools.lru_cache(maxsize=None)
+def get_template(version_year, tax_year, variant):
+  """Return a filing in which the EIN has yet to be filled in."""
+  return make_filing(PLACEHOLDER_EIN, tax_year, version_year,
+                     seed=hash((version_year, tax_year, variant)))
+
+
+def get_filing(object_id):
+  """Return the filing of object_id in an old or new schema version."""
+  h = object_hash(object_id, 'filing')
+  version_year = SCHEMA_VERSIONS[int(h * len(SCHEMA_VERSIONS))]
+  variant = int(h * len(SCHEMA_VERSIONS) * N_VARIANTS) % N_VARIANTS
+  tax_year = int(object_id[:4]) - 1
+  template = get_template(version_year, tax_year, variant)
+  ein = object_ein(object_id)
+  return template.replace(PLACEHOLDER_EIN.encode(), ein.encode())
+
+
+def make_app(n_filings=10000, latency=0.05, jitter=0.5, not_found=0.02,
+             errors=0.01, timeouts=0.0, hang=300, seed=0):
+  """Create the application serving the mock bucket.
+
+  Each filing waits latency seconds, varied by a factor of up to jitter. A
+  fraction not_found of filings always return 404, while any request fails
+  with a 503 with probability errors or stalls for hang seconds with
+  probability timeouts."""
+  rng = random.Random(seed)
+
+  async def index_handler(request):
+    year = int(request.match_info['year'])
+    body = make_index(year, n_filings, request.url.port)
+    return web.json_response(body)
+
+  async def filing_handler(request):
+    object_id = request.match_info['object_id']
+    if not object_id.isdigit() or int(object_id[4:]) >= n_filings:
+      return web.Response(status=404)
+    await asyncio.sleep(latency * (1 + jitter * (2 * rng.random() - 1)))
+    if object_hash(object_id, 'missing') < not_found:
+      return web.Response(status=404)
+    if (r := rng.random()) < errors:
+      return web.Response(status=503)
+    if r < errors + timeouts:
+      await asyncio.sleep(hang)
+    return web.Response(body=get_filing(object_id),
+                        content_type='application/xml')
+
+  app = web.Application()
+  app.router.add_get(PREFIX + '/index_{year}.json', index_handler)
+  app.router.add_get(PREFIX + '/{object_id}_public.xml', filing_handler)
+  return app
+
+
+def serve(port=PORT, **kwargs):
+  """Run the mock bucket until interrupted."""
+  # clients abandoning stalled requests are expected, not worth a traceback
+  for name in ('aiohttp.server', 'asyncio'):
+    logging.getLogger(name).setLevel(logging.CRITICAL)
+  web.run_app(make_app(**kwargs), host='127.0.0.1', port=port, print=None)
+
+
+def start_server(port=PORT, **kwargs):
+  """Run the mock bucket in a separate process and wait until it is up.
+
+  The returned process should be terminated when done."""
+  process = multiprocessing.Process(target=serve, args=(port,), kwargs=kwargs,
+                                    daemon=True)
+  process.start()
+  deadline = time.monotonic() + 30
+  while time.monotonic() < deadline:
+    try:
+      with socket.create_connection(('127.0.0.1', port), timeout=1):
+        return process
+    except OSError:
+      time.sleep(0.1)
+  process.terminate()
+  raise TimeoutError(f'Mock bucket did not start on port {port}.')
+
+
+if __name__ == '__main__':
+  print(f'Serving a mock bucket at {get_base_url()}')
+  serve()
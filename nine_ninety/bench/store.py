@@ -0,0 +1,68 @@
+"""Benchmark reading scaled features from the feature store against csv."""
+
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from nine_ninety.models.store import FeatureStore, write_store
+from nine_ninety.bench.preprocess import make_frame, scale
+
+
+def check_round_trip(df, store, rows=None):
+  """Check rows of store equal those of the scaled DataFrame df.
+
+  Identifiers, booleans and text are compared exactly, and other numeric
+  columns after rounding to float32."""
+  expected = df if rows is None else df.iloc[rows]
+  expected = expected.reset_index(drop=True)
+  actual = store.to_frame(rows)
+  assert list(actual.columns) == list(expected.columns)
+  for k in expected.columns:
+    if k in store.id_columns:
+      assert np.array_equal(actual[k], expected[k]), k
+    elif k in store.metadata['bools']:
+      assert np.array_equal(actual[k], expected[k].astype(bool)), k
+    elif k in store.columns:
+      assert np.array_equal(actual[k], expected[k].astype('float32'),
+                            equal_nan=True), k
+    else:
+      assert list(actual[k]) == list(expected[k].fillna('')), k
+
+
+def run_benchmark(n=400000, n_selected=50000, chunksize=100000):
+  """Check the store reads back what was written, and time reading it."""
+  print(f'Building {n} scaled rows ...')
+  df = scale(make_frame(n))
+  path = tempfile.mkdtemp(prefix='nine_ninety_bench_')
+  try:
+    store_path = os.path.join(path, 'features')
+    chunks = (df.iloc[i: i + chunksize] for i in range(0, n, chunksize))
+    write_store(chunks, store_path)
+    csv_path = os.path.join(path, 'scaled_data.csv')
+    df.to_csv(csv_path, index=False)
+
+    start = time.perf_counter()
+    pd.read_csv(csv_path)
+    csv = time.perf_counter() - start
+    start = time.perf_counter()
+    store = FeatureStore(store_path)
+    opened = time.perf_counter() - start
+    rows = np.sort(np.random.default_rng(0).choice(n, n_selected, False))
+    start = time.perf_counter()
+    store.to_frame(rows)
+    selected = time.perf_counter() - start
+
+    check_round_trip(df, store)
+    check_round_trip(df, store, rows)
+  finally:
+    shutil.rmtree(path)
+
+  print(f'csv:   read {n} rows in {csv:8.3f}s')
+  print(f'store: opened in {opened:8.3f}s, read {n_selected} rows in '
+        f'{selected:.3f}s')
+
+
+if __name__ == '__main__':
+  run_benchmark()
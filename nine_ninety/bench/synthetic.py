@@ -0,0 +1,104 @@
+"""Generate synthetic 990 XML filings in the old and new schema versions."""
+
+import random
+from lxml import etree
+from nine_ninety.scrape.utils import XP, OFFICER_PATHS
+
+
+NAMESPACE = 'http://www.irs.gov/efile'
+
+
+def random_value(key, data_type, ein, tax_year, rng):
+  """Return a plausible text value for a key."""
+  if key == 'ein':
+    return ein
+  if key == 'tax_year':
+    return str(tax_year)
+  if key == 'organization_name':
+    return f'Synthetic Organization {ein}'
+  if key == 'mission':
+    words = ['serve', 'community', 'youth', 'education', 'health',
+             'provide', 'support', 'arts', 'families', 'research']
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(5, 40)))
+  if key == 'founded_year':
+    return str(rng.randint(1850, tax_year))
+  if data_type == 'bool':
+    return rng.choice(['true', 'false', '1', '0', 'X'])
+  if data_type == 'float':
+    return str(round(rng.random(), 4))
+  return str(rng.randint(-10 ** 5, 10 ** 7))
+
+
+def add_path(root, path, text):
+  """Create elements along path below root, reusing existing elements."""
+  element = root
+  for step in path.split('/'):
+    tag = f'{{{NAMESPACE}}}{step}'
+    child = element.find(tag)
+    if child is None:
+      child = etree.SubElement(element, tag)
+    element = child
+  element.text = text
+  return element
+
+
+def make_filing(ein, tax_year, version_year=2016, n_officers=8,
+                n_schedule_items=200, missing=0.1, seed=None):
+  """Build a synthetic filing and return it as bytes.
+
+  A fraction missing of the xpaths are left out, and a long schedule of
+  unrelated elements mimics the attachments found in real filings."""
+  rng = random.Random(seed)
+  root = etree.Element(f'{{{NAMESPACE}}}Return', nsmap={None: NAMESPACE})
+  root.set('returnVersion', f'{version_year}v3.0')
+
+  if version_year < 2013:
+    column = 'old_xpath'
+    officer_path = OFFICER_PATHS['old']
+  else:
+    column = 'new_xpath'
+    officer_path = OFFICER_PATHS['new']
+
+  for _, row in XP.iterrows():
+    key = row['key']
+    if key not in ('ein', 'tax_year') and rng.random() < missing:
+      continue
+    path = row[column]
+    if version_year == 2013 and key == 'organization_name':
+      path = path[:-3]
+    text = random_value(key, row['data_type'], ein, tax_year, rng)
+    add_path(root, path, text)
+
+  group_path, salary_step = officer_path.rsplit('/', 1)
+  parent_path, group_step = group_path.rsplit('/', 1)
+  parent = add_path(root, parent_path, None)
+  for _ in range(n_officers):
+    group = etree.SubElement(parent, f'{{{NAMESPACE}}}{group_step}')
+    etree.SubElement(group, f'{{{NAMESPACE}}}PersonNm').text = 'Jane Doe'
+    salary = etree.SubElement(group, f'{{{NAMESPACE}}}{salary_step}')
+    salary.text = str(rng.randint(0, 500000))
+
+  schedule = add_path(root, 'ReturnData/IRS990ScheduleO', None)
+  for i in range(n_schedule_items):
+    detail = etree.SubElement(schedule,
+                              f'{{{NAMESPACE}}}SupplementalInfoDetail')
+    reference = etree.SubElement(detail,
+                                 f'{{{NAMESPACE}}}FormAndLineReferenceDesc')
+    reference.text = f'Part VI, Line {i}'
+    explanation = etree.SubElement(detail, f'{{{NAMESPACE}}}ExplanationTxt')
+    explanation.text = 'Explanation ' * rng.randint(5, 50)
+
+  return etree.tostring(root, xml_declaration=True, encoding='utf-8')
+
+
+def make_filings(n, seed=0, **kwargs):
+  """Build n synthetic filings spread over old and new schema versions."""
+  rng = random.Random(seed)
+  filings = []
+  for i in range(n):
+    version_year = rng.choice([2010, 2011, 2012, 2013, 2014, 2016, 2018])
+    ein = f'{rng.randint(10 ** 8, 10 ** 9 - 1):09}'
+    tax_year = max(version_year, 2011) - rng.randint(0, 1)
+    filings.append(make_filing(ein, tax_year, version_year, seed=seed + i,
+                               **kwargs))
+  return filings
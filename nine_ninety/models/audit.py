@@ -0,0 +1,91 @@
+"""Flag possible human errors in the boolean indicators of every organization.
+
+An organization ticking a box such as is_school in some tax years but not in
+others has likely made a mistake on one of its forms. The disagreement rate
+of an organization and category is the fraction of its filings disagreeing
+with a reference filing, as in mission.prob_human_error."""
+
+
+import os
+import time
+import numpy as np
+import pandas as pd
+from nine_ninety.scrape.utils import get_boolean_keys, load_data
+from nine_ninety.models.groups import EinIndex
+
+
+def audit_human_error(full_df, index=None, keys=None, positions=None):
+  """Return the disagreement rate of every organization and category.
+
+  All keys, by default every boolean key, are scored in one pass over the
+  rows grouped by the EinIndex of full_df, built unless given. The reference
+  filing of each organization is at positions, by default the one with the
+  longest mission as in mission.prepare_data. Organizations whose filings
+  all agree are left out. Rows are ranked by disagreement, then by number
+  of filings."""
+  if index is None:
+    index = EinIndex(full_df)
+  if keys is None:
+    keys = [k for k in get_boolean_keys() if k in full_df.columns]
+  if positions is None:
+    positions = index.argmax(full_df['mission'].str.len().to_numpy())
+
+  values = full_df[keys].fillna(0).to_numpy(dtype=bool)
+  sizes = index.sizes[:, None]
+  n_true = np.zeros((len(index), len(keys)), dtype=np.int64)
+  if len(values):
+    # summing each contiguous group of rows sorted by EIN
+    n_true = np.add.reduceat(values[index.order].astype(np.int64),
+                             index.bounds[:-1], axis=0)
+  marked = values[positions]
+  n_agree = np.where(marked, n_true, sizes - n_true)
+  disagreement = 1.0 - n_agree / sizes
+
+  # long format, keeping only organizations and categories with a conflict
+  group, key = np.nonzero(disagreement)
+  audit = pd.DataFrame({
+      'ein': index.eins[group],
+      'category': np.array(keys, dtype=object)[key],
+      'n_filings': index.sizes[group],
+      'n_true': n_true[group, key],
+      'marked': marked[group, key],
+      'disagreement': disagreement[group, key]})
+  audit = audit.sort_values(['disagreement', 'n_filings'], ascending=False,
+                            kind='stable')
+  return audit.reset_index(drop=True)
+
+
+def join_predictions(audit, preds):
+  """Join the probabilities predicted by a model to audit.
+
+  The DataFrame preds is indexed by EIN with a column of probabilities per
+  category. The distance between the reference mark and the prediction is
+  the model's disagreement. Rows are ranked by the mean of both
+  disagreements, and rows of categories without predictions are dropped."""
+  long_preds = preds.rename_axis('ein').reset_index().melt(
+      id_vars='ein', var_name='category', value_name='prob')
+  audit = audit.merge(long_preds, on=['ein', 'category'])
+  audit['model_disagreement'] = (audit['marked'].astype(float) -
+                                 audit['prob']).abs()
+  score = (audit['disagreement'] + audit['model_disagreement']) / 2
+  audit = audit.iloc[np.argsort(-score.to_numpy(), kind='stable')]
+  return audit.reset_index(drop=True)
+
+
+def summarize_audit(audit):
+  """Print the number of flagged organizations of each category."""
+  counts = audit.groupby('category').agg(
+      organizations=('ein', 'size'),
+      mean_disagreement=('disagreement', 'mean'))
+  print(counts.sort_values('organizations', ascending=False).to_string())
+
+
+if __name__ == '__main__':
+  full_df = load_data()
+  start = time.perf_counter()
+  audit = audit_human_error(full_df)
+  print(f'Audited {full_df["ein"].nunique()} organizations in '
+        f'{time.perf_counter() - start:.1f} s.')
+  summarize_audit(audit)
+  path = os.path.join(os.path.dirname(__file__), 'audit.csv')
+  audit.to_csv(path, index=False)
@@ -0,0 +1,66 @@
+"""Index the rows of 990 data by organization once and reuse the groups."""
+
+import numpy as np
+
+
+class EinIndex:
+  """Rows of a DataFrame grouped by EIN with sorted arrays and offsets.
+
+  The positions of all rows are sorted by EIN once. The rows of the i-th
+  organization in eins are then order[bounds[i]: bounds[i + 1]], found with
+  a binary search on eins. Row positions refer to df.iloc and stay valid as
+  long as df is not reordered."""
+
+  def __init__(self, df):
+    ein = df['ein'].to_numpy()
+    self.order = np.argsort(ein, kind='stable')
+    sorted_ein = ein[self.order]
+    first = np.ones(len(ein), dtype=bool)
+    first[1:] = sorted_ein[1:] != sorted_ein[:-1]
+    self.eins = sorted_ein[first]
+    self.bounds = np.append(np.flatnonzero(first), len(ein))
+    # group number of every row, in the original order of df
+    self.codes = np.empty(len(ein), dtype=np.int64)
+    self.codes[self.order] = np.cumsum(first) - 1
+
+  def __len__(self):
+    return len(self.eins)
+
+  def __contains__(self, ein):
+    return self.find(ein) is not None
+
+  @property
+  def sizes(self):
+    """Number of rows of each organization."""
+    return np.diff(self.bounds)
+
+  def find(self, ein):
+    """Return the group number of ein, or None if it has no rows."""
+    i = np.searchsorted(self.eins, ein)
+    if i < len(self.eins) and self.eins[i] == ein:
+      return i
+    return None
+
+  def positions(self, ein):
+    """Return positions of the rows of ein, in their order within df."""
+    if (i := self.find(ein)) is None:
+      return self.order[:0]
+    return self.order[self.bounds[i]: self.bounds[i + 1]]
+
+  def rows(self, df, ein):
+    """Return the rows of ein from the DataFrame the index was built on."""
+    return df.iloc[self.positions(ein)]
+
+  def argmax(self, values):
+    """Return the position of the largest value of each organization.
+
+    As with idxmax, ties go to the first row in df."""
+    values = np.asarray(values)
+    positions = np.arange(len(values))
+    order = np.lexsort((positions, -values, self.codes))
+    return order[self.bounds[:-1]]
+
+  def sample(self, rng=np.random):
+    """Return the position of one randomly chosen row of each organization."""
+    offsets = (rng.random(len(self)) * self.sizes).astype(np.int64)
+    return self.order[self.bounds[:-1] + offsets]
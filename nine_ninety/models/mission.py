@@ -10,14 +10,20 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import roc_curve
 import matplotlib.pyplot as plt
 from nine_ninety.scrape.utils import get_boolean_keys, load_data
+from nine_ninety.models.groups import EinIndex
+from nine_ninety.models.audit import audit_human_error, join_predictions
+from nine_ninety.models.tokens import load_tokens
 
 
-def prepare_data(full_df):
-  """Prepare data to use in model."""
-  grouped = full_df.groupby('ein')
+def prepare_data(full_df, index=None):
+  """Prepare data to use in model.
+
+  The EinIndex of full_df is built unless given."""
+  if index is None:
+    index = EinIndex(full_df)
   # for each EIN, take the tax year with the longest mission statement
-  idx = grouped['mission'].agg(lambda x: x.str.len().idxmax())
-  df = full_df.iloc[idx.values].set_index('ein')
+  idx = index.argmax(full_df['mission'].str.len().to_numpy())
+  df = full_df.iloc[idx].set_index('ein')
   mask = df['mission'].str.len() < 40
   print(f'Removing {sum(mask)} organization with short missions.')
   df = df[~mask]
@@ -53,8 +59,12 @@ def split_data(df, category, over_sample=False):
   return x_train, y_train, x_test, y_test
 
 
-def build_encoder(vocab_size, sequence_length, x_train):
-  """Build and fit TensorFlow TextVectorization object."""
+def build_encoder(vocab_size, sequence_length, x_train, tokens=None):
+  """Build and fit TensorFlow TextVectorization object.
+
+  Given a TokenCache, its vocabulary is set rather than adapting to x_train."""
+  if tokens is not None:
+    return tokens.build_encoder()
   encoder = TextVectorization(max_tokens=vocab_size,
                               output_sequence_length=sequence_length)
   encoder.adapt(x_train.values)
@@ -79,11 +89,13 @@ def determine_class_weights(y_train):
   return output_bias, class_weight
 
 
-def build_model(encoder, output_bias, embedding_dim):
-  """Build Sequential model."""
+def build_model(encoder, output_bias, embedding_dim, on_ids=False):
+  """Build Sequential model.
 
-  model = tf.keras.Sequential([
-      encoder,
+  If on_ids, the model takes token ids from a TokenCache rather than text,
+  and the encoder only sets the vocabulary size."""
+
+  model = tf.keras.Sequential(([] if on_ids else [encoder]) + [
       tf.keras.layers.Embedding(
           input_dim=encoder.get_config()['max_tokens'] + 1,
           output_dim=embedding_dim),
@@ -109,6 +121,11 @@ def build_model(encoder, output_bias, embedding_dim):
   return model
 
 
+def with_encoder(model, encoder):
+  """Return a model taking text, sharing its weights with a model on ids."""
+  return tf.keras.Sequential([encoder, model])
+
+
 def plot_training_metrics(history, category, eval_results):
   """Plot training metrics."""
 
@@ -126,28 +143,34 @@ def plot_training_metrics(history, category, eval_results):
   plt.show()
 
 
-def prob_human_error(full_df, df, ein, category):
-  """Determine if there is a possible human error on the 990 form."""
-  all_marked = full_df[full_df['ein'] == ein][category]
+def prob_human_error(full_df, df, ein, category, index):
+  """Determine if there is a possible human error on the 990 form.
+
+  The EinIndex of full_df is built once by the caller and shared by every
+  call, rather than grouping the rows for each EIN."""
+  all_marked = full_df[category].to_numpy()[index.positions(ein)]
   specific_marked = df[category][ein]
   n_agree = (all_marked == specific_marked).sum()
   assert n_agree  # since specific_marked is included in all_marked
   return 1.0 - n_agree / len(all_marked)
 
 
-def print_initial_rows(data_frame, full_df, df, category):
+def print_initial_rows(data_frame, full_df, df, category, index):
   for ein, row in data_frame.iterrows():
     print('ein:', ein)
     print('prediction:', row['pred'])
     print('actual:', row['actual'])
     print('probability human error:',
-          prob_human_error(full_df, df, ein, category))
+          prob_human_error(full_df, df, ein, category, index))
     print('mission:', row['mission'])
     print('')
 
 
-def explore_model_misclassified(model, x_test, y_test, full_df, df, category):
+def explore_model_misclassified(model, x_test, y_test, full_df, df, category,
+                                index=None):
   """Explore test data in which model incorrectly identifies class."""
+  if index is None:
+    index = EinIndex(full_df)
   for i, class_name in enumerate(['POSITIVES', 'NEGATIVES']):
     d = pd.DataFrame(x_test[y_test == i])
     d['pred'] = model.predict(d)
@@ -155,18 +178,21 @@ def explore_model_misclassified(model, x_test, y_test, full_df, df, category):
     d = d.sort_values('pred', ascending=i)
     d = d.iloc[:10]
     print('TOP FALSE ' + class_name + '\n')
-    print_initial_rows(d, full_df, df, category)
+    print_initial_rows(d, full_df, df, category, index)
 
 
-def explore_model_ambiguity(model, x_test, y_test, full_df, df, category):
+def explore_model_ambiguity(model, x_test, y_test, full_df, df, category,
+                            index=None):
   """Explore test data in which model cannot identify class."""
+  if index is None:
+    index = EinIndex(full_df)
   y_pred = model.predict(x_test)
   d = pd.DataFrame(
       {'mission': x_test, 'actual': y_test, 'pred': y_pred.flatten()})
   d['ambiguity'] = (d['pred'] - 0.5).abs()
   d = d.sort_values('ambiguity').drop(columns=['ambiguity'])
   d = d.iloc[:20]
-  print_initial_rows(d, full_df, df, category)
+  print_initial_rows(d, full_df, df, category, index)
 
 
 def plot_roc(actual, pred):
@@ -184,7 +210,8 @@ def plot_roc(actual, pred):
 
 if __name__ == '__main__':
   full_df = load_data()
-  df = prepare_data(full_df)
+  index = EinIndex(full_df)
+  df = prepare_data(full_df, index)
   category = 'is_school'
   print_size(df, category)
   x_train, y_train, x_test, y_test = split_data(df, category, over_sample=True)
@@ -192,8 +219,12 @@ if __name__ == '__main__':
   print('Sampling from the encoder vocabulary ...')
   vocab_size = 3000
   sequence_length = 100
-  encoder = build_encoder(vocab_size, sequence_length, x_train)
+  # adapting and encoding every mission once, reused across runs
+  tokens = load_tokens(df['mission'], vocab_size, sequence_length)
+  encoder = build_encoder(vocab_size, sequence_length, x_train, tokens)
   sample_encoder_vocab(encoder, x_train)
+  ids_train = tokens.take(df.index.get_indexer(x_train.index))
+  ids_test = tokens.take(df.index.get_indexer(x_test.index))
 
   embedding_dim = 32
   batch_size = 64
@@ -201,26 +232,35 @@ if __name__ == '__main__':
   output_bias, class_weight = determine_class_weights(y_train)
   print('output bias:', output_bias)
   print('class weights:', class_weight)
-  model = build_model(encoder, output_bias, embedding_dim)
+  model = build_model(encoder, output_bias, embedding_dim, on_ids=True)
 
   # tracing computation in order to print summary of network
-  model(x_train.iloc[:batch_size])
+  model(ids_train[:batch_size])
   print(model.summary())
   print('Training ...')
-  history = model.fit(x_train, y_train, batch_size=batch_size,
+  history = model.fit(ids_train, y_train, batch_size=batch_size,
                       epochs=epochs, class_weight=class_weight,
                       validation_split=0.1)
 
   print('Evaluating ...')
-  eval_results = model.evaluate(x_test, y_test, verbose=1)
+  eval_results = model.evaluate(ids_test, y_test, verbose=1)
   metric_keys = list(history.history.keys())
   metric_keys = metric_keys[:len(metric_keys) // 2]
   eval_results = dict(zip(metric_keys, eval_results))
   plot_training_metrics(history, category, eval_results)
 
   print('Exploring mistakes ...')
-  explore_model_misclassified(model, x_test, y_test, full_df, df, category)
-  explore_model_ambiguity(model, x_test, y_test, full_df, df, category)
+  text_model = with_encoder(model, encoder)
+  explore_model_misclassified(text_model, x_test, y_test, full_df, df,
+                              category, index)
+  explore_model_ambiguity(text_model, x_test, y_test, full_df, df, category,
+                          index)
 
   print('Plotting ROC ...')
-  plot_roc(y_test, model.predict(x_test))
+  plot_roc(y_test, model.predict(ids_test))
+
+  print('Auditing possible human errors ...')
+  audit = audit_human_error(full_df, index, [category])
+  preds = pd.DataFrame({category: model.predict(tokens.ids).flatten()},
+                       index=df.index)
+  print(join_predictions(audit, preds).head(20))
@@ -0,0 +1,150 @@
+"""Predict every boolean category of an organization from its mission
+statement with a single model."""
+
+
+import tensorflow as tf
+import pandas as pd
+import numpy as np
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import roc_auc_score
+from nine_ninety.scrape.utils import get_boolean_keys, load_data
+from nine_ninety.models.groups import EinIndex
+from nine_ninety.models.audit import audit_human_error, join_predictions
+from nine_ninety.models.tokens import load_tokens
+from nine_ninety.models.mission import prepare_data, build_encoder
+from nine_ninety.models.mission import sample_encoder_vocab
+
+
+def get_categories(df):
+  """Return the boolean keys of df holding both classes."""
+  return [k for k in get_boolean_keys() if df[k].nunique() > 1]
+
+
+def split_data(df, categories):
+  """Split data into train and test sets with a column per category."""
+  df_train, df_test = train_test_split(df, test_size=0.2)
+  x_train = df_train['mission']
+  y_train = df_train[categories].astype('float32')
+  x_test = df_test['mission']
+  y_test = df_test[categories].astype('float32')
+  return x_train, y_train, x_test, y_test
+
+
+def determine_label_weights(y_train):
+  """Determine imbalance of each category in training set.
+
+  As determine_class_weights does for a single category, returns the
+  output bias matching the rate of positives, and weights of positives and
+  negatives making both classes count equally in the loss."""
+  pos = np.maximum(y_train.sum().to_numpy(), 1)
+  neg = np.maximum(len(y_train) - pos, 1)
+  total = neg + pos
+  output_bias = tf.keras.initializers.Constant(np.log(pos / neg))
+  weights = {0: (total / neg).astype('float32'),
+             1: (total / pos).astype('float32')}
+  return output_bias, weights
+
+
+def weighted_binary_crossentropy(weights):
+  """Return binary crossentropy with a weight per category and class."""
+  neg = tf.constant(weights[0])
+  pos = tf.constant(weights[1])
+
+  def loss(y_true, y_pred):
+    y_true = tf.cast(y_true, y_pred.dtype)
+    y_pred = tf.clip_by_value(y_pred, 1e-7, 1 - 1e-7)
+    crossentropy = -(y_true * tf.math.log(y_pred) +
+                     (1 - y_true) * tf.math.log(1 - y_pred))
+    weight = y_true * pos + (1 - y_true) * neg
+    return tf.reduce_mean(weight * crossentropy, axis=-1)
+
+  return loss
+
+
+def build_model(vocab_size, n_labels, output_bias, weights, embedding_dim):
+  """Build Sequential model on token ids with an output per category.
+
+  The embedding and hidden layers are shared by all categories."""
+
+  model = tf.keras.Sequential([
+      tf.keras.layers.Embedding(input_dim=vocab_size + 1,
+                                output_dim=embedding_dim),
+      tf.keras.layers.GlobalAveragePooling1D(),
+      tf.keras.layers.Dropout(0.2),
+      tf.keras.layers.Dense(256, activation='relu'),
+      tf.keras.layers.Dropout(0.2),
+      tf.keras.layers.Dense(n_labels, activation='sigmoid',
+                            bias_initializer=output_bias)])
+
+  optimizer = tf.keras.optimizers.Adam(lr=1e-4)
+  loss = weighted_binary_crossentropy(weights)
+  metrics = [tf.keras.metrics.BinaryAccuracy(name='accuracy'),
+             tf.keras.metrics.AUC(name='auc', multi_label=True,
+                                  num_labels=n_labels)]
+
+  model.compile(optimizer=optimizer, loss=loss, metrics=metrics)
+  return model
+
+
+def evaluate_labels(y_true, y_pred, threshold=0.5):
+  """Return counts, precision, recall and AUC of each category.
+
+  The DataFrame y_true has a column per category, and y_pred holds the
+  predicted probabilities in the same order."""
+  actual = y_true.to_numpy().astype(bool)
+  pred = np.asarray(y_pred) >= threshold
+  results = pd.DataFrame(index=y_true.columns)
+  results['positives'] = actual.sum(axis=0)
+  results['tp'] = (actual & pred).sum(axis=0)
+  results['fp'] = (~actual & pred).sum(axis=0)
+  results['fn'] = (actual & ~pred).sum(axis=0)
+  results['tn'] = (~actual & ~pred).sum(axis=0)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    results['precision'] = results['tp'] / (results['tp'] + results['fp'])
+    results['recall'] = results['tp'] / (results['tp'] + results['fn'])
+  results['auc'] = [roc_auc_score(actual[:, i], np.asarray(y_pred)[:, i])
+                    if 0 < results['positives'].iloc[i] < len(actual)
+                    else np.nan for i in range(actual.shape[1])]
+  return results
+
+
+if __name__ == '__main__':
+  full_df = load_data()
+  index = EinIndex(full_df)
+  df = prepare_data(full_df, index)
+  categories = get_categories(df)
+  print(f'Predicting {len(categories)} categories.')
+  x_train, y_train, x_test, y_test = split_data(df, categories)
+
+  print('Sampling from the encoder vocabulary ...')
+  vocab_size = 3000
+  sequence_length = 100
+  tokens = load_tokens(df['mission'], vocab_size, sequence_length)
+  encoder = build_encoder(vocab_size, sequence_length, x_train, tokens)
+  sample_encoder_vocab(encoder, x_train)
+  ids_train = tokens.take(df.index.get_indexer(x_train.index))
+  ids_test = tokens.take(df.index.get_indexer(x_test.index))
+
+  embedding_dim = 32
+  batch_size = 64
+  epochs = 5
+  output_bias, weights = determine_label_weights(y_train)
+  model = build_model(vocab_size, len(categories), output_bias, weights,
+                      embedding_dim)
+
+  # tracing computation in order to print summary of network
+  model(ids_train[:batch_size])
+  print(model.summary())
+  print('Training ...')
+  model.fit(ids_train, y_train.to_numpy(), batch_size=batch_size,
+            epochs=epochs, validation_split=0.1)
+
+  print('Evaluating ...')
+  results = evaluate_labels(y_test, model.predict(ids_test))
+  print(results.sort_values('auc', ascending=False).to_string())
+
+  print('Auditing possible human errors ...')
+  audit = audit_human_error(full_df, index, categories)
+  preds = pd.DataFrame(model.predict(tokens.ids), columns=categories,
+                       index=df.index)
+  print(join_predictions(audit, preds).head(20))
@@ -1,65 +1,161 @@
 """Clean, normalize, and engineering new features from scraped data."""
 
-import os
+import functools
 import numpy as np
 import pandas as pd
-from nine_ninety.scrape.utils import load_data, XP
-from tqdm import tqdm
-tqdm.pandas()
+from nine_ninety.scrape.utils import load_data, iter_data, XP
+from nine_ninety.models.groups import EinIndex
+from nine_ninety.models.store import FeatureStore, write_store
+
+
+CHUNKSIZE = 100000  # rows per chunk when scaling data year by year
+
+
+def as_chunks(data):
+  """Return data as an iterable of DataFrames."""
+  return [data] if isinstance(data, pd.DataFrame) else data
+
+
+def chunkwise(func):
+  """Let func, acting on each row of a DataFrame, also map over chunks."""
+
+  @functools.wraps(func)
+  def wrapper(data, *args, **kwargs):
+    if isinstance(data, pd.DataFrame):
+      return func(data, *args, **kwargs)
+    return (func(chunk, *args, **kwargs) for chunk in data)
+
+  return wrapper
+
+
+def founded_year_modes(data, index=None):
+  """Return the scaled founded year of each organization.
+
+  Counts of plausible founded years are accumulated per EIN over a DataFrame
+  or chunks from iter_data. As with mode().mean(), ties between the most
+  common years are averaged. Values are normalized to lie between [-4.0,
+  0.2], and are mostly close to 0. A DataFrame is grouped with its
+  EinIndex, built unless given."""
+  if isinstance(data, pd.DataFrame):
+    return grouped_modes(data, index or EinIndex(data))
+
+  counts = None
+  for chunk in as_chunks(data):
+    chunk = chunk[chunk['founded_year'].between(1600, 2030)]
+    c = chunk.groupby(['ein', 'founded_year']).size()
+    counts = c if counts is None else counts.add(c, fill_value=0)
+  top = counts[counts == counts.groupby(level='ein').transform('max')]
+  modes = top.reset_index().groupby('ein')['founded_year'].mean()
+  return (modes - 2000) / 100
+
+
+def grouped_modes(df, index):
+  """Return founded_year_modes of df using the groups of its EinIndex."""
+  years = df['founded_year'].to_numpy()
+  mask = (years >= 1600) & (years <= 2030)
+  codes, years = index.codes[mask], years[mask]
+  order = np.lexsort((years, codes))
+  codes, years = codes[order], years[order]
+
+  # runs of equal (ein, founded_year) pairs, then the largest run of each ein
+  first = np.ones(len(codes), dtype=bool)
+  first[1:] = (codes[1:] != codes[:-1]) | (years[1:] != years[:-1])
+  starts = np.flatnonzero(first)
+  counts = np.diff(np.append(starts, len(codes)))
+  run_codes, run_years = codes[starts], years[starts]
+  code_starts = np.flatnonzero(np.diff(run_codes, prepend=-1))
+  largest = np.maximum.reduceat(counts, code_starts) if len(counts) else counts
+  top = counts == np.repeat(largest, np.diff(np.append(code_starts,
+                                                       len(counts))))
+
+  n_top = np.bincount(run_codes[top], minlength=len(index))
+  total = np.bincount(run_codes[top], weights=run_years[top],
+                      minlength=len(index))
+  has_mode = n_top > 0
+  modes = total[has_mode] / n_top[has_mode]
+  return pd.Series((modes - 2000) / 100, index=index.eins[has_mode])
+
+
+def scale_founded_year(df, modes=None, index=None, inplace=False):
+  """Use organization group to fix and scale founded years.
+
+  Chunks from iter_data need modes from founded_year_modes over every chunk,
+  as the filings of an organization can span several chunks. A DataFrame is
+  grouped with its EinIndex, built unless given. If inplace, df is modified
+  rather than copied."""
+  if not isinstance(df, pd.DataFrame):
+    if modes is None:
+      raise ValueError('Pass modes from founded_year_modes to scale chunks.')
+    return (scale_founded_year(chunk, modes, inplace=inplace) for chunk in df)
 
-
-def scale_founded_year(df):
-  """Use organization group to fix and scale founded years."""
   print('Scaling year founded ....')
-  grouped = df.copy().groupby('ein')
-
-  def apply_to_group(group):
-    mask = group['founded_year'].between(1600, 2030)
-    m = group['founded_year'][mask].mode().mean()
-    if pd.isnull(m):
-      m = 2000  # a default value
-    # normalize so values are between [-4.0, 0.2], and mostly close to 0.
-    m = (m - 2000) / 100
-    group['founded_year'] = m
-    return group
-
-  return grouped.progress_apply(apply_to_group)
-
+  if index is None:
+    index = EinIndex(df)
+  if modes is None:
+    modes = founded_year_modes(df, index)
+  if not inplace:
+    df = df.copy()
+  # organizations without a plausible year get the default of 2000
+  scaled = modes.reindex(index.eins).fillna(0.0).to_numpy()
+  df['founded_year'] = scaled[index.codes]
+  return df
 
-def include_ratios(df):
-  """Include numeric data as ratio of category total."""
-  print('Building ratios ....')
 
-  df_copy = df.copy()
+def get_ratio_keys():
+  """Return pairs of numerator and denominator keys of ratio features."""
   ratio_keys = []
   for category in ['revenue', 'expense', 'assets', 'liabilities']:
     filt = XP['category'] == category
     ratio_keys += [(key, 'total_' + category) for key in XP[filt]['key']]
-
-  for key1, key2 in tqdm(ratio_keys):
-    df_copy[key1 + '_ratio'] = (df_copy[key1] / df_copy[key2]).clip(-1, 1)
-
   for key in ['minus1_endowment', 'minus2_endowment',
               'minus3_endowment', 'minus4_endowment']:
-    df_copy[key + '_ratio'] = (df_copy[key] /
-                               df['current_endowment']).clip(-1, 1)
-
+    ratio_keys.append((key, 'current_endowment'))
   for key in ['officer_1', 'officer_2', 'officer_3', 'officer_4']:
-    df_copy[key + '_ratio'] = (df_copy[key] / df['officer_0']).clip(-1, 1)
+    ratio_keys.append((key, 'officer_0'))
+  return ratio_keys
+
 
-  df_copy = df_copy.fillna(0.0)
-  return df_copy
+@chunkwise
+def include_ratios(df, inplace=False):
+  """Include numeric data as ratio of category total.
+
+  All ratios are divided and clipped as one 2-D array. If inplace, the
+  columns are added to df rather than to a copy."""
+  print('Building ratios ....')
+
+  numerators, denominators = zip(*get_ratio_keys())
+  with np.errstate(divide='ignore', invalid='ignore'):
+    ratios = (df[list(numerators)].to_numpy(dtype='float64') /
+              df[list(denominators)].to_numpy(dtype='float64'))
+  np.clip(ratios, -1, 1, out=ratios)
+
+  if not inplace:
+    df = df.copy()
+  df[[key + '_ratio' for key in numerators]] = ratios
+  df.fillna(0.0, inplace=True)
+  return df
 
 
-def log_scale(df):
-  """Apply log scaling and normalization to numeric columns."""
+@chunkwise
+def log_scale(df, inplace=False):
+  """Apply log scaling and normalization to numeric columns.
+
+  The signed log of all numeric columns is taken as one 2-D array. If
+  inplace, the columns of df are replaced rather than those of a copy."""
   print('Log scaling numeric data ....')
 
-  df_copy = df.copy()
-  for key in tqdm(get_numeric_keys(False)):
-    s = np.sign(df[key])
-    df_copy[key] = s * np.log(df[key] * s + 1)
-  return df_copy
+  keys = get_numeric_keys(False)
+  # avoiding overflow in compact integers
+  x = df[keys].to_numpy(dtype='float64')
+  s = np.sign(x)
+  x = np.abs(x)
+  x += 1
+  np.log(x, out=x)
+  x *= s
+  if not inplace:
+    df = df.copy()
+  df[keys] = x
+  return df
 
 
 def get_numeric_keys(include_floats=True):
@@ -76,34 +172,53 @@ def get_numeric_keys(include_floats=True):
   return keys
 
 
-def scale_df():
-  """Apply scaling and normalization to loaded DataFrame."""
-  df = load_data()
-  df = scale_founded_year(df)
-  # df = include_ratios(df)
-  df = log_scale(df)
+def scale_df(chunksize=None, year=None):
+  """Apply scaling and normalization to loaded DataFrame.
+
+  The data of year, by default every year, is loaded once and then scaled
+  in place. If chunksize is given, return a generator of scaled chunks
+  instead, so only one chunk of the data is held in memory at a time.
+  Chunks never span more than one year."""
+  if chunksize is not None:
+    years = None if year is None else [year]
+    modes = founded_year_modes(iter_data(years, columns=['founded_year'],
+                                         chunksize=chunksize))
+    chunks = iter_data(years, chunksize=chunksize)
+    chunks = scale_founded_year(chunks, modes, inplace=True)
+    # chunks = include_ratios(chunks, inplace=True)
+    return log_scale(chunks, inplace=True)
+  df = load_data(year)
+  df = scale_founded_year(df, inplace=True)
+  # df = include_ratios(df, inplace=True)
+  df = log_scale(df, inplace=True)
   return df
 
 
-def read_scaled_df():
-  """Read scaled_data.csv and return as pd.DataFrame."""
+def read_scaled_df(rows=None, columns=None):
+  """Read rows of the feature store and return as pd.DataFrame."""
   print('Reading scaled data ...')
-  path = os.path.dirname(__file__)
-  path = os.path.join(path, 'scaled_data.csv')
-  return pd.read_csv(path)
-
-
-def random_tax_year(df):
-  """Group df by EIN and keep a randomly sampled year."""
-
-  # the snippet below is much more performant than df = grouped.sample()
-  grouped = df.groupby('ein')
-  keeps = [np.random.choice(arr) for arr in grouped.indices.values()]
-  new_df = df.iloc[keeps]
+  return FeatureStore().to_frame(rows, columns)
+
+
+def random_tax_year(df, index=None):
+  """Group df by EIN and keep a randomly sampled year.
+
+  A DataFrame is grouped with its EinIndex, built unless given. Chunks from
+  iter_data are reduced as they arrive by giving every row a random key and
+  keeping the row with the largest key of each EIN."""
+  if not isinstance(df, pd.DataFrame):
+    kept = None
+    for chunk in df:
+      chunk = chunk.assign(random_key=np.random.random(len(chunk)))
+      kept = chunk if kept is None else pd.concat([kept, chunk])
+      kept = kept.sort_values('random_key').drop_duplicates('ein', keep='last')
+    return kept.drop(columns='random_key').reset_index(drop=True)
+
+  if index is None:
+    index = EinIndex(df)
+  new_df = df.iloc[index.sample()]
   return new_df.reset_index(drop=True)
 
 
 if __name__ == '__main__':
-  df = scale_df()
-  path = os.path.join(os.path.dirname(__file__), 'scaled_data.csv')
-  df.to_csv(path, index=False)
+  print(f'Saved scaled data to {write_store(scale_df(CHUNKSIZE))}.')
@@ -10,33 +10,52 @@ from sklearn.metrics import mean_squared_error as mse
 from sklearn.metrics import mean_absolute_error as mae
 from sklearn.metrics import mean_absolute_percentage_error as mape
 from tensorflow.keras.layers.experimental import preprocessing
-from nine_ninety.models.preprocess import read_scaled_df, random_tax_year
+from nine_ninety.models.store import FeatureStore
+from nine_ninety.models.groups import EinIndex
+from nine_ninety.models.tokens import load_tokens
 
 
-def build_df(min_n_employees=2, max_n_employees=7):
-  """Read and filter DataFrame."""
-  df = read_scaled_df()
+MAX_FEATURES = 5000
+SEQUENCE_LENGTH = 100
+
+
+def build_df(min_n_employees=2, max_n_employees=7, store=None):
+  """Select rows from the feature store and read them into a DataFrame.
+
+  The DataFrame is indexed by the positions of its rows in the store."""
+  store = store or FeatureStore()
+  n_employees = store.column('n_employees')
 
   # there are many organizations (~ 35%) without any employees
-  filt = df['n_employees'].between(min_n_employees, max_n_employees)
-  print(f'Removing {sum(~filt)} organizations.')
-  print(f'Keeping {sum(filt)} organizations.')
-  df = df[filt]
-  df = df.reset_index(drop=True)
+  filt = (n_employees >= min_n_employees) & (n_employees <= max_n_employees)
+  print(f'Removing {(~filt).sum()} organizations.')
+  print(f'Keeping {filt.sum()} organizations.')
+  rows = np.flatnonzero(filt)
 
   # only keep one row per organization to avoid "cheating"
-  df = random_tax_year(df)
-
-  # disregard several other columns in addition to already dropped ein
-  df = df.drop(columns=['tax_year', 'organization_name'])
+  index = EinIndex(pd.DataFrame({'ein': store.ids('ein', rows)}))
+  rows = rows[index.sample()]
+
+  # disregard several other columns in addition to ein
+  dropped = ['ein', 'tax_year', 'organization_name']
+  columns = [k for k in store.metadata['columns'] if k not in dropped]
+  df = store.to_frame(rows, columns)
+  df.index = rows
   return df
 
 
-def split_data(df):
-  """Split DataFrame into inputs and outputs."""
+def split_data(df, tokens=None):
+  """Split DataFrame into inputs and outputs.
+
+  Given the TokenCache of every mission in the store, the token ids of the
+  rows of df, indexed by store positions as in build_df, are included as
+  x_train_ids and x_test_ids."""
   df_train, df_test = train_test_split(df, test_size=0.2)
 
   data = {}
+  if tokens is not None:
+    data['x_train_ids'] = tokens.take(df_train.index)
+    data['x_test_ids'] = tokens.take(df_test.index)
 
   data['y_train'] = df_train.pop('n_employees')
   data['x_train_text'] = df_train.pop('mission').astype(str)
@@ -49,22 +68,26 @@ def split_data(df):
   return data
 
 
-def build_model(x_train_text, x_train_numeric, **kwargs):
-  """Build TF model."""
-
-  max_features = 5000
-  sequence_length = 100
+def build_model(x_train_text, x_train_numeric, x_train_ids=None, **kwargs):
+  """Build TF model.
 
-  encoder = preprocessing.TextVectorization(max_tokens=max_features,
-                                            output_sequence_length=sequence_length)
-  encoder.adapt(x_train_text.values)
+  Given x_train_ids from split_data, the text input takes token ids and the
+  encoder is neither adapted nor part of the model."""
 
   normalizer = preprocessing.Normalization()
   normalizer.adapt(x_train_numeric.values)
 
-  text_input = tf.keras.Input(shape=(None,), name='text', dtype='string')
-  embedded = encoder(text_input)
-  embedded = layers.Embedding(input_dim=max_features, output_dim=128)(embedded)
+  if x_train_ids is not None:
+    text_input = tf.keras.Input(shape=(SEQUENCE_LENGTH,), name='text',
+                                dtype='int32')
+    embedded = text_input
+  else:
+    encoder = preprocessing.TextVectorization(
+        max_tokens=MAX_FEATURES, output_sequence_length=SEQUENCE_LENGTH)
+    encoder.adapt(x_train_text.values)
+    text_input = tf.keras.Input(shape=(None,), name='text', dtype='string')
+    embedded = encoder(text_input)
+  embedded = layers.Embedding(input_dim=MAX_FEATURES, output_dim=128)(embedded)
   # LSTM doesn't improved performance
   # embedded = layers.LSTM(128)(embedded)
   embedded = layers.GlobalAveragePooling1D()(embedded)
@@ -102,14 +125,15 @@ def run_model(model, data):
 
   epochs = 10
   batch_size = 32
-  model.fit({'text': data['x_train_text'],
+  # token ids are fed in place of text when split_data was given a cache
+  model.fit({'text': data.get('x_train_ids', data['x_train_text']),
              'numeric': data['x_train_numeric']},
             data['y_train'],
             validation_split=0.2,
             batch_size=batch_size,
             epochs=epochs)
 
-  model.evaluate({'text': data['x_test_text'],
+  model.evaluate({'text': data.get('x_test_ids', data['x_test_text']),
                   'numeric': data['x_test_numeric']},
                  data['y_test'],
                  verbose=1)
@@ -129,8 +153,11 @@ def linear_model(data):
 
 
 if __name__ == '__main__':
-  df = build_df()
-  data = split_data(df)
+  store = FeatureStore()
+  df = build_df(store=store)
+  # keyed by every mission in the store, the cache is reused across samples
+  tokens = load_tokens(store.text('mission'), MAX_FEATURES, SEQUENCE_LENGTH)
+  data = split_data(df, tokens)
   linear_model(data)
 
   model = build_model(**data, only_numeric=True)
@@ -0,0 +1,189 @@
+"""Store scaled features in binary files read through memory maps.
+
+Identifiers, ein and tax_year, are saved exactly as a row-major int64
+matrix, and other numeric and boolean columns as one row-major float32
+matrix. Each text column, such as mission, is saved as the utf-8 bytes of
+all its values back to back along with int64 offsets, so the i-th value is
+bytes[offsets[i]: offsets[i + 1]]. A json file records the shape, column
+names and the fingerprints of the xpaths the data was extracted with."""
+
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from nine_ninety.scrape.index import get_data_path
+from nine_ninety.scrape.utils import get_fingerprints
+
+
+STORE_VERSION = 2
+ID_COLUMNS = ['ein', 'tax_year']  # too large or too exact for float32
+IDS_FILE = 'ids.i64'
+NUMERIC_FILE = 'numeric.f32'
+METADATA_FILE = 'metadata.json'
+
+
+def get_store_path():
+  """Return the directory of the feature store."""
+  return os.path.join(get_data_path(), 'features')
+
+
+def map_file(path, dtype, shape):
+  """Return a read only memory map of path, which mmap refuses when empty."""
+  if not os.path.getsize(path):
+    return np.zeros(shape, dtype=dtype)
+  return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+def encode_text(key, value):
+  """Return the utf-8 bytes of a value of a text column."""
+  if isinstance(value, str):
+    return value.encode()
+  if value is None or value is pd.NA or (isinstance(value, float) and
+                                         np.isnan(value)):
+    return b''
+  raise TypeError(f'Column {key} holds {value!r}, which is not text.')
+
+
+def write_store(chunks, path=None):
+  """Write DataFrames from chunks into a feature store and return its path.
+
+  The columns of the first chunk are kept. Identifiers are kept as int64,
+  other numeric and boolean columns as float32, and the remaining columns
+  as text with missing values stored as empty strings. Text columns holding
+  anything other than strings raise a TypeError. The store is written next
+  to path and moved in place once complete."""
+  path = path or get_store_path()
+  tmp_path = path + '.tmp'
+  shutil.rmtree(tmp_path, ignore_errors=True)
+  os.makedirs(tmp_path)
+
+  columns = ids = numeric = bools = text = None
+  files, ends = {}, {}
+  n_rows = 0
+  try:
+    for chunk in chunks:
+      if columns is None:
+        columns = list(chunk.columns)
+        ids = [k for k in ID_COLUMNS if k in columns]
+        numeric = [k for k in chunk.select_dtypes(['number', 'bool']).columns
+                   if k not in ids]
+        bools = list(chunk[numeric].select_dtypes('bool').columns)
+        text = [k for k in columns if k not in ids and k not in numeric]
+        files['ids'] = open(os.path.join(tmp_path, IDS_FILE), 'wb')
+        files['numeric'] = open(os.path.join(tmp_path, NUMERIC_FILE), 'wb')
+        for k in text:
+          files[k] = open(os.path.join(tmp_path, f'{k}.bytes'), 'wb')
+          files[k + '_offsets'] = open(os.path.join(tmp_path,
+                                                    f'{k}.offsets'), 'wb')
+          files[k + '_offsets'].write(np.zeros(1, dtype=np.int64).tobytes())
+          ends[k] = 0
+
+      matrix = chunk[ids].to_numpy(dtype=np.int64)
+      files['ids'].write(np.ascontiguousarray(matrix).tobytes())
+      matrix = chunk[numeric].to_numpy(dtype=np.float32)
+      files['numeric'].write(np.ascontiguousarray(matrix).tobytes())
+      for k in text:
+        encoded = [encode_text(k, v) for v in chunk[k]]
+        lengths = np.fromiter(map(len, encoded), np.int64, len(encoded))
+        files[k].write(b''.join(encoded))
+        files[k + '_offsets'].write((ends[k] + np.cumsum(lengths)).tobytes())
+        ends[k] += int(lengths.sum())
+      n_rows += len(chunk)
+  finally:
+    for f in files.values():
+      f.close()
+  if columns is None:
+    raise ValueError('No data to write to the feature store.')
+
+  metadata = {'version': STORE_VERSION, 'n_rows': n_rows, 'columns': columns,
+              'ids': ids, 'numeric': numeric, 'bools': bools, 'text': text,
+              'fingerprints': get_fingerprints()}
+  with open(os.path.join(tmp_path, METADATA_FILE), 'w') as f:
+    json.dump(metadata, f, indent=2)
+  shutil.rmtree(path, ignore_errors=True)
+  os.replace(tmp_path, path)
+  return path
+
+
+class FeatureStore:
+  """Read only view of a feature store through memory maps.
+
+  Nothing is read from disk until rows are selected. Rows are selected by
+  an array of positions, and only the pages holding those rows are read."""
+
+  def __init__(self, path=None):
+    self.path = path or get_store_path()
+    metadata_path = os.path.join(self.path, METADATA_FILE)
+    if not os.path.exists(metadata_path):
+      raise FileNotFoundError(f'No feature store at {self.path}. Run '
+                              'python -m nine_ninety.models.preprocess.')
+    with open(metadata_path) as f:
+      self.metadata = json.load(f)
+    if (self.metadata['version'] != STORE_VERSION or
+            self.metadata['fingerprints'] != get_fingerprints()):
+      raise ValueError('The feature store was built from other xpaths. Run '
+                       'python -m nine_ninety.models.preprocess.')
+
+    n = self.metadata['n_rows']
+    self.id_columns = self.metadata['ids']
+    self.columns = self.metadata['numeric']
+    self.text_columns = self.metadata['text']
+    self.id_values = map_file(os.path.join(self.path, IDS_FILE), np.int64,
+                              (n, len(self.id_columns)))
+    self.numeric = map_file(os.path.join(self.path, NUMERIC_FILE), np.float32,
+                            (n, len(self.columns)))
+    self.offsets, self.buffers = {}, {}
+    for k in self.text_columns:
+      offsets = os.path.join(self.path, f'{k}.offsets')
+      self.offsets[k] = map_file(offsets, np.int64, (n + 1,))
+      buffer = os.path.join(self.path, f'{k}.bytes')
+      self.buffers[k] = memoryview(map_file(buffer, np.uint8,
+                                            (int(self.offsets[k][-1]),)))
+
+  def __len__(self):
+    return self.metadata['n_rows']
+
+  def ids(self, key, rows=None):
+    """Return the exact int64 values of an identifier at rows."""
+    values = self.id_values[:, self.id_columns.index(key)]
+    return values if rows is None else values[rows]
+
+  def column(self, key):
+    """Return a numeric column as a strided view of the memory map."""
+    return self.numeric[:, self.columns.index(key)]
+
+  def take(self, rows=None, columns=None):
+    """Return the numeric values of rows as a float32 array.
+
+    All rows are returned without copying if rows is None; otherwise only
+    the rows selected are read into a new array."""
+    x = self.numeric if rows is None else self.numeric[rows]
+    if columns is not None:
+      x = x[:, [self.columns.index(k) for k in columns]]
+    return x
+
+  def text(self, key, rows=None):
+    """Return the values of a text column at rows as a list of strings."""
+    offsets, buffer = self.offsets[key], self.buffers[key]
+    if rows is None:
+      starts, ends = offsets[:-1], offsets[1:]
+    else:
+      rows = np.asarray(rows)
+      starts, ends = offsets[rows], offsets[rows + 1]
+    return [str(buffer[s:e], 'utf-8') for s, e in zip(starts.tolist(),
+                                                      ends.tolist())]
+
+  def to_frame(self, rows=None, columns=None):
+    """Return rows as a DataFrame, by default with every column."""
+    keys = columns or self.metadata['columns']
+    numeric = [k for k in keys if k in self.columns]
+    df = pd.DataFrame(self.take(rows, numeric), columns=numeric, copy=False)
+    for k in keys:
+      if k in self.metadata['bools']:
+        df[k] = df[k].astype(bool)
+      elif k in self.id_columns:
+        df[k] = self.ids(k, rows)
+      elif k in self.text_columns:
+        df[k] = self.text(k, rows)
+    return df[keys]
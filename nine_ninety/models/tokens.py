@@ -0,0 +1,136 @@
+"""Cache the vocabulary and token ids of mission statements across runs.
+
+A TextVectorization layer is adapted once per corpus and setting of vocab
+size and sequence length. Every mission is then encoded once into a matrix
+of int32 token ids saved next to the vocabulary, so models can train on ids
+without adapting or standardizing strings again."""
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers.experimental.preprocessing import TextVectorization
+from nine_ninety.scrape.index import get_data_path
+from nine_ninety.models.store import map_file
+
+
+BATCH_SIZE = 10000  # missions hashed or encoded at once
+MAX_CACHES = 4  # caches kept, dropping the least recently used
+IDS_FILE = 'ids.i32'
+VOCABULARY_FILE = 'vocabulary.json'
+
+
+def get_tokens_path():
+  """Return the directory holding cached token ids."""
+  return os.path.join(get_data_path(), 'tokens')
+
+
+def hash_corpus(missions):
+  """Return the sha1 of missions, which depends on their order."""
+  h = hashlib.sha1()
+  for i in range(0, len(missions), BATCH_SIZE):
+    batch = [str(m) for m in missions[i: i + BATCH_SIZE]]
+    h.update('\0'.join(batch).encode() + b'\0')
+  return h.hexdigest()
+
+
+class TokenCache:
+  """Vocabulary and memory mapped token ids of a corpus of missions.
+
+  Row i of ids holds the sequence_length token ids of the i-th mission, as
+  returned by a TextVectorization layer with the cached vocabulary."""
+
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, VOCABULARY_FILE)) as f:
+      metadata = json.load(f)
+    self.vocabulary = metadata['vocabulary']
+    self.vocab_size = metadata['vocab_size']
+    self.sequence_length = metadata['sequence_length']
+    self.ids = map_file(os.path.join(path, IDS_FILE), np.int32,
+                        (metadata['n_rows'], self.sequence_length))
+
+  def __len__(self):
+    return len(self.ids)
+
+  def take(self, rows):
+    """Return the token ids of missions at rows as an int32 array."""
+    return self.ids[np.asarray(rows)]
+
+  def build_encoder(self):
+    """Return a TextVectorization layer set to the cached vocabulary."""
+    encoder = TextVectorization(max_tokens=self.vocab_size,
+                                output_sequence_length=self.sequence_length)
+    # the mask and OOV tokens, '' and '[UNK]', are added by the layer
+    encoder.set_vocabulary(self.vocabulary[2:])
+    return encoder
+
+  def decode(self, ids):
+    """Return the words of token ids, leaving out padding."""
+    return ' '.join(self.vocabulary[i] for i in ids if i)
+
+
+def build_tokens(missions, vocab_size, sequence_length, path):
+  """Adapt an encoder to missions and save the vocabulary and token ids."""
+  print('Adapting text encoder ...')
+  encoder = TextVectorization(max_tokens=vocab_size,
+                              output_sequence_length=sequence_length)
+  encoder.adapt(np.asarray(missions, dtype=str))
+
+  print('Encoding missions ...')
+  tmp_path = path + '.tmp'
+  shutil.rmtree(tmp_path, ignore_errors=True)
+  os.makedirs(tmp_path)
+  with open(os.path.join(tmp_path, IDS_FILE), 'wb') as f:
+    for i in range(0, len(missions), BATCH_SIZE):
+      batch = np.asarray(missions[i: i + BATCH_SIZE], dtype=str)
+      ids = encoder(tf.constant(batch)).numpy().astype(np.int32)
+      f.write(ids.tobytes())
+  metadata = {'n_rows': len(missions), 'vocab_size': vocab_size,
+              'sequence_length': sequence_length,
+              'vocabulary': [str(w) for w in encoder.get_vocabulary()]}
+  with open(os.path.join(tmp_path, VOCABULARY_FILE), 'w') as f:
+    json.dump(metadata, f)
+  shutil.rmtree(path, ignore_errors=True)
+  os.replace(tmp_path, path)
+
+
+def prune_tokens(keep=MAX_CACHES):
+  """Remove all but the keep most recently used caches, and unfinished ones."""
+  tokens_path = get_tokens_path()
+  if not os.path.exists(tokens_path):
+    return
+  used = {}
+  for d in os.listdir(tokens_path):
+    vocabulary_path = os.path.join(tokens_path, d, VOCABULARY_FILE)
+    used[d] = (os.path.getmtime(vocabulary_path)
+               if os.path.exists(vocabulary_path) else None)
+  complete = sorted((d for d in used if used[d] is not None),
+                    key=used.get, reverse=True)
+  for d in used:
+    if d not in complete[:keep]:
+      print(f'Removing stale token ids {d} ...')
+      shutil.rmtree(os.path.join(tokens_path, d), ignore_errors=True)
+
+
+def load_tokens(missions, vocab_size, sequence_length):
+  """Return the TokenCache of missions, building it if not yet cached.
+
+  The cache is keyed by the hash of missions, in order, along with
+  vocab_size and sequence_length, so missions should be a fixed corpus, such
+  as every mission in the feature store, rather than a random sample. Only
+  the MAX_CACHES most recently used caches are kept."""
+  missions = list(missions)
+  key = f'{hash_corpus(missions)[:16]}_{vocab_size}_{sequence_length}'
+  path = os.path.join(get_tokens_path(), key)
+  vocabulary_path = os.path.join(path, VOCABULARY_FILE)
+  if not os.path.exists(vocabulary_path):
+    build_tokens(missions, vocab_size, sequence_length, path)
+    prune_tokens()
+  else:
+    print('Loading cached token ids ...')
+    # marking the cache as recently used
+    os.utime(vocabulary_path)
+  return TokenCache(path)
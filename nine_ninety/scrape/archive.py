@@ -0,0 +1,191 @@
+"""Keep downloaded XML on disk in compressed, append-only archive segments."""
+
+import os
+import time
+import zlib
+from nine_ninety.scrape.index import get_data_path
+from nine_ninety.scrape.utils import parse_filing, timed_parse_filing
+
+
+SEGMENT_SIZE = 2 ** 28  # start a new segment after 256MB of compressed XML
+COMPRESSION_LEVEL = 6
+INDEX_NAME = 'index.csv'
+INDEX_HEADER = 'object_id,ein,segment,offset,length\n'
+
+
+def get_archive_path(year):
+  """Return the directory holding raw XML archive segments for year."""
+  raw_dir = os.path.join(get_data_path(), 'raw')
+  if not os.path.exists(raw_dir):
+    os.makedirs(raw_dir)
+  path = os.path.join(raw_dir, str(year))
+  if not os.path.exists(path):
+    os.mkdir(path)
+  return path
+
+
+def segment_name(segment):
+  """Return file name of a numbered segment."""
+  return f'segment_{segment:03}.bin'
+
+
+class RawArchive:
+  """Per-year archive of zlib compressed filings.
+
+  Each filing is compressed on its own and appended to the current segment,
+  so it can be read back with a single seek. The index file maps object ids
+  to (ein, segment, offset, length); a length of 0 records a 404."""
+
+  def __init__(self, year, mode='r'):
+    if mode not in ('r', 'a'):
+      raise ValueError('mode must be "r" or "a".')
+    self.year = year
+    self.mode = mode
+    self.path = get_archive_path(year)
+    self.records = {}  # object_id -> (ein, segment, offset, length)
+    self.by_ein = {}  # ein -> list of object_ids
+    self._readers = {}
+    self._writer = None
+    self._index = None
+    self.segment = 0
+
+    index_path = os.path.join(self.path, INDEX_NAME)
+    if os.path.exists(index_path):
+      self._load_index(index_path)
+    if mode == 'a':
+      new_index = not os.path.exists(index_path)
+      self._index = open(index_path, 'a')
+      if new_index:
+        self._index.write(INDEX_HEADER)
+      self._open_writer()
+
+  def _load_index(self, index_path):
+    with open(index_path) as f:
+      next(f)  # header
+      for line in f:
+        fields = line.rstrip('\n').split(',')
+        if len(fields) != 5:
+          continue  # a partial line left by an interrupted write
+        object_id, ein, segment, offset, length = fields
+        record = (ein, int(segment), int(offset), int(length))
+        if object_id not in self.records:
+          self.by_ein.setdefault(ein, []).append(object_id)
+        self.records[object_id] = record
+        self.segment = max(self.segment, record[1])
+
+  def _open_writer(self):
+    if self._writer is not None:
+      self._writer.close()
+    path = os.path.join(self.path, segment_name(self.segment))
+    self._writer = open(path, 'ab')
+
+  def __len__(self):
+    return len(self.records)
+
+  def __contains__(self, object_id):
+    return object_id in self.records
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def append(self, org, xml):
+    """Compress and store xml for org; None stores a 404."""
+    self.append_compressed(org, compress(xml))
+
+  def append_compressed(self, org, blob):
+    """Store a blob returned by compress for org; b'' stores a 404."""
+    if self.mode != 'a':
+      raise ValueError('Archive was not opened for appending.')
+    offset = self._writer.tell()
+    if blob and offset + len(blob) > SEGMENT_SIZE and offset > 0:
+      self.segment += 1
+      self._open_writer()
+      offset = self._writer.tell()
+    self._writer.write(blob)
+
+    object_id, ein = org['ObjectId'], org['EIN']
+    record = (ein, self.segment, offset, len(blob))
+    if object_id not in self.records:
+      self.by_ein.setdefault(ein, []).append(object_id)
+    self.records[object_id] = record
+    fields = [object_id, ein, self.segment, offset, len(blob)]
+    self._index.write(','.join(map(str, fields)) + '\n')
+
+  def flush(self):
+    """Flush segment data before the index pointing into it."""
+    if self._writer is not None:
+      self._writer.flush()
+      self._index.flush()
+
+  def close(self):
+    """Close all open files."""
+    self.flush()
+    for f in [self._writer, self._index] + list(self._readers.values()):
+      if f is not None:
+        f.close()
+    self._writer = None
+    self._index = None
+    self._readers = {}
+
+  def read_compressed(self, object_id):
+    """Return the compressed bytes stored for object_id, b'' for a 404."""
+    _, segment, offset, length = self.records[object_id]
+    if not length:
+      return b''
+    if self._writer is not None and segment == self.segment:
+      self._writer.flush()
+    if segment not in self._readers:
+      path = os.path.join(self.path, segment_name(segment))
+      self._readers[segment] = open(path, 'rb')
+    f = self._readers[segment]
+    f.seek(offset)
+    return f.read(length)
+
+  def get(self, object_id):
+    """Return raw XML stored for object_id, None for a 404."""
+    return decompress(self.read_compressed(object_id))
+
+  def get_ein(self, ein):
+    """Return a list of raw XML of every filing stored for ein."""
+    return [self.get(object_id) for object_id in self.by_ein.get(ein, [])]
+
+  def scan(self, compressed=False):
+    """Yield (object_id, xml) in on-disk order for a sequential read."""
+    order = sorted(self.records.items(), key=lambda item: item[1][1:3])
+    for object_id, _ in order:
+      blob = self.read_compressed(object_id)
+      yield object_id, blob if compressed else decompress(blob)
+
+
+def compress(xml):
+  """Return the blob stored in the archive for xml, b'' for a 404."""
+  if xml is None:
+    return b''
+  return zlib.compress(xml, COMPRESSION_LEVEL)
+
+
+def decompress(blob):
+  """Inverse of the compression used in the archive."""
+  if not blob:
+    return None
+  return zlib.decompress(blob)
+
+
+def parse_archived(blob, org, streaming=False, keys=None):
+  """Decompress and parse a filing read from the archive in a worker process."""
+  return parse_filing(decompress(blob), org, streaming, keys)
+
+
+def timed_parse_archiving(xml, org, streaming=False, keys=None):
+  """Run timed_parse_filing and also compress xml for the archive.
+
+  Both run in a worker process, leaving only the write to the caller."""
+  data, timings = timed_parse_filing(xml, org, streaming, keys)
+  start = time.perf_counter()
+  blob = compress(xml)
+  if xml is not None:
+    timings['compress'] = time.perf_counter() - start
+  return data, timings, blob
@@ -0,0 +1,164 @@
+"""Ingest filings from local ZIP or tar bundles of 990 XML without requests."""
+
+import os
+import re
+import sys
+import asyncio
+import tarfile
+import zipfile
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from nine_ninety.scrape.utils import timed_parse_filing
+from nine_ninety.scrape.index import locate_object_ids
+from nine_ninety.scrape.journal import Journal, DONE
+from nine_ninety.scrape.metrics import METRICS
+from nine_ninety.scrape.scrape import PARSE_WORKERS, STREAMING_PARSE
+from nine_ninety.scrape.scrape import count_unfinished, run_years
+
+
+LOOKUP_SIZE = 500  # members joined to the index with one query
+MAX_PENDING = 16 * PARSE_WORKERS  # filings read ahead of the parsers
+# members are named after the object id, e.g. 201541349349307794_public.xml
+MEMBER_PATTERN = re.compile(r'(\d+)(_public)?\.xml$')
+
+
+def get_object_id(name):
+  """Return the object id in the name of an archive member, or None."""
+  match = MEMBER_PATTERN.search(os.path.basename(name))
+  return None if match is None else match.group(1)
+
+
+def iter_members(path):
+  """Yield (object_id, xml) for every filing in a ZIP or tar archive.
+
+  Members are decompressed one at a time straight from the archive, which
+  is never extracted to disk. Tar archives are read as a stream."""
+  if zipfile.is_zipfile(path):
+    with zipfile.ZipFile(path) as archive:
+      for info in archive.infolist():
+        if not info.is_dir() and (object_id := get_object_id(info.filename)):
+          yield object_id, archive.read(info)
+  elif tarfile.is_tarfile(path):
+    with tarfile.open(path, 'r|*') as archive:
+      for member in archive:
+        if member.isfile() and (object_id := get_object_id(member.name)):
+          yield object_id, archive.extractfile(member).read()
+  else:
+    raise ValueError(f'{path} is neither a ZIP nor a tar archive.')
+
+
+def iter_chunks(members, size=LOOKUP_SIZE):
+  """Group members into lists of at most size."""
+  chunk = []
+  for member in members:
+    chunk.append(member)
+    if len(chunk) == size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+class Ingestion:
+  """Record parsed archive members in the journal of their year."""
+
+  def __init__(self):
+    self.journals = {}
+    self.counts = Counter()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    for journal in self.journals.values():
+      journal.close()
+
+  def get_journal(self, year):
+    """Return the journal of year, opening it once."""
+    if year not in self.journals:
+      self.journals[year] = Journal(year)
+    return self.journals[year]
+
+  def join(self, chunk):
+    """Return (year, org, xml) for members of chunk still to be ingested."""
+    located = locate_object_ids(object_id for object_id, _ in chunk)
+    self.counts['not indexed'] += len(chunk) - len(located)
+    by_year = {}
+    for year, org in located.values():
+      by_year.setdefault(year, []).append(org)
+    unfinished = set()
+    for year, orgs in by_year.items():
+      unfinished.update(org['ObjectId']
+                        for org in self.get_journal(year).unfinished(orgs))
+
+    joined = []
+    for object_id, xml in chunk:
+      if object_id in unfinished:
+        joined.append((*located[object_id], xml))
+        unfinished.discard(object_id)  # a member repeated in the chunk
+      elif object_id in located:
+        self.counts['already recorded'] += 1
+    return joined
+
+  def record(self, year, org, future):
+    """Record the parsed filing, leaving filings failing to parse unfinished."""
+    try:
+      row, timings = future.result()
+    except Exception as e:
+      tqdm.write(f'Could not parse {org["ObjectId"]}: {e!r}')
+      self.counts['not parsed'] += 1
+      return
+    for stage, seconds in timings.items():
+      METRICS.observe(stage, seconds)
+    self.get_journal(year).record(org, DONE, row)
+    self.counts[year] += 1
+
+
+def ingest_archives(paths):
+  """Parse the filings in archives at paths into the journals of their years.
+
+  Members are joined to the index by the object id in their name, and EINs
+  are checked against the index by verify. Returns the number of filings
+  recorded per year."""
+  with Ingestion() as ingestion:
+    with ProcessPoolExecutor(PARSE_WORKERS) as pool:
+      for path in paths:
+        print(f'Ingesting {path} ...')
+        pending = deque()
+        for chunk in tqdm(iter_chunks(iter_members(path)), unit='chunk'):
+          for year, org, xml in ingestion.join(chunk):
+            future = pool.submit(timed_parse_filing, xml, org, STREAMING_PARSE)
+            pending.append((year, org, future))
+            while pending and (len(pending) > MAX_PENDING or
+                               pending[0][2].done()):
+              ingestion.record(*pending.popleft())
+        while pending:
+          ingestion.record(*pending.popleft())
+    counts = ingestion.counts
+
+  for k in ('not indexed', 'already recorded', 'not parsed'):
+    if counts[k]:
+      print(f'Skipped {counts[k]} members: {k}.')
+  return {k: v for k, v in counts.items() if isinstance(k, int)}
+
+
+def ingest(paths, fetch_missing=False):
+  """Ingest archives, then save every year they completed.
+
+  Filings of a year missing from the archives are fetched from AWS only if
+  fetch_missing; otherwise such years are left for the scraper to finish."""
+  years = []
+  for year, n in sorted(ingest_archives(paths).items()):
+    print(f'Recorded {n} filings from {year}.')
+    if (n_missing := count_unfinished(year)) and not fetch_missing:
+      print(f'{n_missing} filings from {year} are not in the archives.')
+    else:
+      years.append(year)
+  if years:
+    asyncio.run(run_years(years))
+
+
+if __name__ == '__main__':
+  args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+  ingest(args, fetch_missing='--fetch-missing' in sys.argv)
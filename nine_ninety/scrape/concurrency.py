@@ -0,0 +1,97 @@
+"""Adapt the number of in-flight requests to the observed state of the link."""
+
+import time
+import asyncio
+
+
+class AdaptiveLimiter:
+  """Limit concurrent requests with additive increase, multiplicative decrease.
+
+  Each success grows the window by increase / window, or about increase per
+  round trip of a full window. Errors, timeouts and bad statuses shrink the
+  window by the factor decrease, as does smoothed latency climbing above
+  latency_tolerance times the best recent latency. Decreases happen at most
+  once per smoothed round trip so a burst of errors counts only once."""
+
+  def __init__(self, min_limit=4, max_limit=200, initial=None, increase=1.0,
+               decrease=0.7, latency_tolerance=2.0, smoothing=0.05):
+    if not 1 <= min_limit <= max_limit:
+      raise ValueError('Need 1 <= min_limit <= max_limit.')
+    self.min_limit = min_limit
+    self.max_limit = max_limit
+    self.limit = float(min(max(initial or min_limit, min_limit), max_limit))
+    self.increase = increase
+    self.decrease = decrease
+    self.latency_tolerance = latency_tolerance
+    self.smoothing = smoothing
+
+    self.in_flight = 0
+    self.latency = None  # exponentially smoothed latency in seconds
+    self.best_latency = None
+    self.n_success = 0
+    self.n_failure = 0
+    self._last_decrease = 0.0
+    self._waiters = []
+
+  @property
+  def window(self):
+    """Current number of requests allowed in flight."""
+    return int(self.limit)
+
+  async def acquire(self):
+    """Wait until there is room in the window, then take a slot."""
+    while self.in_flight >= self.window:
+      waiter = asyncio.get_running_loop().create_future()
+      self._waiters.append(waiter)
+      await waiter
+    self.in_flight += 1
+
+  def release(self):
+    """Give back a slot taken with acquire."""
+    self.in_flight -= 1
+    self._wake()
+
+  def _wake(self):
+    waiters, self._waiters = self._waiters, []
+    for waiter in waiters:
+      if not waiter.done():
+        waiter.set_result(None)
+
+  def record_success(self, latency):
+    """Grow the window after a successful request unless latency is high."""
+    self.n_success += 1
+    if self.latency is None:
+      self.latency = latency
+    else:
+      self.latency += self.smoothing * (latency - self.latency)
+    if self.best_latency is None or self.latency < self.best_latency:
+      self.best_latency = self.latency
+    else:
+      # slowly forgetting the best latency so a slower link is not punished
+      drift = self.smoothing / 10
+      self.best_latency += drift * (self.latency - self.best_latency)
+
+    if self.latency > self.latency_tolerance * self.best_latency:
+      self._shrink()
+    else:
+      self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+      self._wake()
+
+  def record_failure(self):
+    """Shrink the window after an error, timeout or bad status."""
+    self.n_failure += 1
+    self._shrink()
+
+  def _shrink(self):
+    now = time.monotonic()
+    if now - self._last_decrease < (self.latency or 0.0):
+      return
+    self._last_decrease = now
+    self.limit = max(self.min_limit, self.limit * self.decrease)
+
+  def summary(self):
+    """Return a dict describing the state of the limiter."""
+    latency = None if self.latency is None else round(1000 * self.latency)
+    return {'window': self.window, 'in_flight': self.in_flight,
+            'latency_ms': latency, 'ok': self.n_success,
+            'errors': self.n_failure}
@@ -0,0 +1,127 @@
+"""Compile xpaths once and extract their values in few passes over the XML."""
+
+from lxml import etree
+
+
+class PathTree:
+  """Trie of xpath steps holding the keys whose xpaths end at each node."""
+
+  def __init__(self):
+    self.children = {}
+    self.tags = ()
+    self.first = []  # keys taking the text of the first match, like find
+    self.every = []  # keys collecting the text of all matches, like findall
+    self.collect_keys = []  # only populated on the root of the trie
+
+
+def compile_paths(paths, namespace=None, collect=()):
+  """Compile a dict of key -> xpath into a PathTree.
+
+  Steps are qualified with namespace so lookups become dict hits on tags.
+  Keys listed in collect gather every match rather than only the first."""
+  root = PathTree()
+  for key, path in paths.items():
+    node = root
+    for step in path.split('/'):
+      tag = step if not namespace else f'{{{namespace}}}{step}'
+      node = node.children.setdefault(tag, PathTree())
+    if key in collect:
+      node.every.append(key)
+      root.collect_keys.append(key)
+    else:
+      node.first.append(key)
+
+  # freezing tag tuples to filter children within lxml rather than python
+  stack = [root]
+  while stack:
+    node = stack.pop()
+    node.tags = tuple(node.children)
+    stack += node.children.values()
+  return root
+
+
+def default_namespace(nsmap):
+  """Return the namespace used by unprefixed xpath steps."""
+  if None in nsmap:
+    return nsmap[None]
+  return nsmap.get('')
+
+
+def extract(root, tree):
+  """Walk only the branches of root named in tree.
+
+  Return a dict of first matches and a dict of lists of all matches."""
+  found = {}
+  collected = {k: [] for k in tree.collect_keys}
+  _walk(root, tree, found, collected)
+  return found, collected
+
+
+def _walk(element, node, found, collected):
+  """Recursively visit the children of element matching node."""
+  for child in element.iterchildren(*node.tags):
+    sub = node.children[child.tag]
+    for key in sub.first:
+      if key not in found:
+        found[key] = child.text
+    for key in sub.every:
+      collected[key].append(child.text)
+    if sub.tags:
+      _walk(child, sub, found, collected)
+
+
+class StreamTarget:
+  """lxml parser target matching xpaths from parser events.
+
+  No tree is ever built; only text of matched elements is kept. The
+  function select is called with the attributes and nsmap of the root
+  element and returns the PathTree to match against."""
+
+  def __init__(self, select):
+    self.select = select
+    self.tree = None
+    self.stack = []  # frames of [node, text parts, still reading text]
+    self.found = {}
+    self.collected = {}
+
+  def start(self, tag, attrib, nsmap=None):
+    if self.tree is None:
+      self.tree = self.select(attrib, nsmap or {})
+      self.collected = {k: [] for k in self.tree.collect_keys}
+      self.stack.append([self.tree, None, False])
+      return
+
+    parent = self.stack[-1]
+    parent[2] = False  # text of parent ends at its first child
+    node = parent[0].children.get(tag) if parent[0] is not None else None
+    if node is not None and (node.first or node.every):
+      self.stack.append([node, [], True])
+    else:
+      self.stack.append([node, None, False])
+
+  def data(self, text):
+    frame = self.stack[-1]
+    if frame[2]:
+      frame[1].append(text)
+
+  def end(self, tag):
+    node, parts, _ = self.stack.pop()
+    if parts is None:
+      return
+    text = ''.join(parts) if parts else None
+    for key in node.first:
+      if key not in self.found:
+        self.found[key] = text
+    for key in node.every:
+      self.collected[key].append(text)
+
+  def close(self):
+    return self.found, self.collected
+
+
+def stream_extract(xml, select):
+  """Extract values from xml bytes or a file object without building a tree."""
+  parser = etree.XMLParser(target=StreamTarget(select))
+  if hasattr(xml, 'read'):
+    return etree.parse(xml, parser)
+  return etree.fromstring(xml, parser)
@@ -1,56 +1,248 @@
-"""Get index json files from AWS."""
+"""Get index json files from AWS and keep them in a local SQLite store."""
 
 import os
+import glob
 import json
+import codecs
+import sqlite3
+import contextlib
 import requests
 
 
+INDEX_URL = 'https://s3.amazonaws.com/irs-form-990'
+CHUNK_SIZE = 2 ** 20  # bytes of index json read from AWS at a time
+INSERT_SIZE = 10000  # entries inserted per executemany
+QUERY_SIZE = 500  # object ids per IN clause, below the SQLite variable limit
+# json keys of an index entry and the columns holding them
+FIELDS = {'ObjectId': 'object_id', 'EIN': 'ein', 'TaxPeriod': 'tax_period',
+          'OrganizationName': 'organization_name', 'FormType': 'form_type',
+          'SubmittedOn': 'submitted_on', 'DLN': 'dln', 'URL': 'url',
+          'LastUpdated': 'last_updated'}
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS filings (
+  year INTEGER NOT NULL,
+  position INTEGER NOT NULL,
+  {', '.join(f'{c} TEXT' for c in FIELDS.values())},
+  PRIMARY KEY (year, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS filings_ein ON filings (ein);
+CREATE INDEX IF NOT EXISTS filings_tax_period ON filings (tax_period);
+CREATE INDEX IF NOT EXISTS filings_object_id ON filings (object_id);
+CREATE TABLE IF NOT EXISTS years (
+  year INTEGER PRIMARY KEY,
+  n_filings INTEGER NOT NULL
+);
+"""
+
+
 def get_data_path():
-  """Return the absolute path of the `data` directory holding 990 data."""
+  """Return the absolute path of the `data` directory holding 990 data.
+
+  The environment variable NINE_NINETY_DATA overrides the default location
+  inside the package."""
+  if path := os.environ.get('NINE_NINETY_DATA'):
+    return path
   cur_dir = os.path.dirname(__file__)
   return os.path.join(cur_dir, '..', 'data')
 
 
-def get_index_path(year):
-  """Return path for index file from year."""
-  if not os.path.exists(get_data_path()):
-    os.mkdir(get_data_path())
-
+def get_index_dir():
+  """Return directory holding the index store."""
   index_dir = os.path.join(get_data_path(), 'index')
   if not os.path.exists(index_dir):
-    os.mkdir(index_dir)
+    os.makedirs(index_dir)
+  return index_dir
+
+
+def get_index_path(year):
+  """Return path for the legacy json index file from year."""
+  return os.path.join(get_index_dir(), f'index_{year}.json')
+
+
+def get_db_path():
+  """Return path of the SQLite index store."""
+  return os.path.join(get_index_dir(), 'index.sqlite')
+
+
+def connect():
+  """Return a connection to the index store, creating its tables if needed."""
+  con = sqlite3.connect(get_db_path())
+  con.execute('PRAGMA journal_mode=WAL')
+  con.executescript(SCHEMA)
+  return con
+
+
+def iter_entries(chunks):
+  """Yield dicts from a json index given as an iterable of byte chunks.
+
+  Only the list of filings is decoded, one entry at a time, so the index is
+  never held in memory as a whole."""
+  decoder = json.JSONDecoder()
+  text_decoder = codecs.getincrementaldecoder('utf-8')()
+  buffer = ''
+  started = False
+  pos = 0
+  for chunk in chunks:
+    buffer = buffer[pos:] + text_decoder.decode(chunk)
+    pos = 0
+    if not started:
+      if (pos := buffer.find('[')) == -1:
+        pos = 0
+        continue
+      pos += 1
+      started = True
+
+    while True:
+      while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+        pos += 1
+      if pos == len(buffer) or buffer[pos] == ']':
+        break
+      try:
+        entry, end = decoder.raw_decode(buffer, pos)
+      except json.JSONDecodeError:
+        break  # entry continues in the next chunk
+      yield entry
+      pos = end
+
+    if pos < len(buffer) and buffer[pos] == ']':
+      return
+
+
+def ingest_index(year, entries):
+  """Replace the stored index of year with the 990 filings in entries."""
+  columns = ['year', 'position'] + list(FIELDS.values())
+  insert = (f'INSERT INTO filings ({", ".join(columns)}) '
+            f'VALUES ({", ".join("?" * len(columns))})')
+  n = 0
+  with contextlib.closing(connect()) as con:
+    with con:
+      con.execute('DELETE FROM filings WHERE year = ?', (year,))
+      con.execute('DELETE FROM years WHERE year = ?', (year,))
+      rows = []
+      for entry in entries:
+        # ignoring 990EZs and 990PFs
+        if entry['FormType'] != '990':
+          continue
+        rows.append([year, n] + [entry.get(k) for k in FIELDS])
+        n += 1
+        if len(rows) == INSERT_SIZE:
+          con.executemany(insert, rows)
+          rows = []
+      con.executemany(insert, rows)
+      # a year is only listed once all of its entries are stored
+      con.execute('INSERT INTO years VALUES (?, ?)', (year, n))
+  return n
+
+
+def count_index(year):
+  """Return the number of filings stored for year, or None if not stored."""
+  with contextlib.closing(connect()) as con:
+    row = con.execute('SELECT n_filings FROM years WHERE year = ?',
+                      (year,)).fetchone()
+  return None if row is None else row[0]
 
-  return os.path.join(index_dir, f'index_{year}.json')
+
+def query_index(where, params=()):
+  """Return index entries passing a SQL where clause, in index order."""
+  columns = ', '.join(FIELDS.values())
+  with contextlib.closing(connect()) as con:
+    rows = con.execute(f'SELECT {columns} FROM filings WHERE {where} '
+                       'ORDER BY year, position', params).fetchall()
+  return [dict(zip(FIELDS, row)) for row in rows]
+
+
+def load_index(year, start=0, stop=None):
+  """Return list of index entries of year between positions start and stop."""
+  if stop is None:
+    return query_index('year = ? AND position >= ?', (year, start))
+  return query_index('year = ? AND position >= ? AND position < ?',
+                     (year, start, stop))
+
+
+def get_object_ids(year):
+  """Return object ids of year in index order."""
+  with contextlib.closing(connect()) as con:
+    rows = con.execute('SELECT object_id FROM filings WHERE year = ? '
+                       'ORDER BY position', (year,)).fetchall()
+  return [row[0] for row in rows]
+
+
+def chunks(items, size=QUERY_SIZE):
+  """Split items into lists of at most size, by default one IN clause each."""
+  items = list(items)
+  return [items[i: i + size] for i in range(0, len(items), size)]
+
+
+def locate_object_ids(object_ids):
+  """Return a dict from each indexed object id to its year and entry."""
+  columns = ', '.join(FIELDS.values())
+  located = {}
+  with contextlib.closing(connect()) as con:
+    for ids in chunks(str(i) for i in object_ids):
+      rows = con.execute(f'SELECT year, {columns} FROM filings WHERE '
+                         f'object_id IN ({", ".join("?" * len(ids))})', ids)
+      for row in rows:
+        entry = dict(zip(FIELDS, row[1:]))
+        located[entry['ObjectId']] = (row[0], entry)
+  return located
+
+
+def find_ein(ein, year=None):
+  """Return index entries filed by ein, optionally only from year."""
+  if year is None:
+    return query_index('ein = ?', (str(ein),))
+  return query_index('ein = ? AND year = ?', (str(ein), year))
+
+
+def find_object_id(object_id):
+  """Return the index entry with object_id, or None if not indexed."""
+  entries = query_index('object_id = ?', (str(object_id),))
+  return entries[0] if entries else None
+
+
+def find_tax_period(tax_period):
+  """Return index entries for a tax period such as '201812'."""
+  return query_index('tax_period = ?', (str(tax_period),))
+
+
+def migrate_json_index(year, path):
+  """Move a legacy json index file of year into the index store."""
+  print(f'Moving {path} into the index store ...')
+  with open(path, 'rb') as f:
+    n = ingest_index(year, iter_entries(iter(lambda: f.read(CHUNK_SIZE),
+                                             b'')))
+  print(f'File contains data for {n} organizations.')
+  os.remove(path)
+
+
+def migrate_json_indexes():
+  """Move any legacy json index files left in the index directory."""
+  for path in sorted(glob.glob(os.path.join(get_index_dir(),
+                                            'index_*.json'))):
+    year = os.path.basename(path)[len('index_'):-len('.json')]
+    if year.isdigit():
+      migrate_json_index(int(year), path)
 
 
 def get_json_index(year, overwrite=False):
-  """Download 990 index file from AWS and save to disk."""
+  """Stream 990 index file from AWS into the index store."""
 
-  if os.path.exists(path := get_index_path(year)):
+  if (n := count_index(year)) is not None and not overwrite:
     print(f'Index file for {year} already saved.')
-    with open(path) as f:
-      data = json.load(f)
-      print(f'File contains data for {len(data)} organizations.')
-    if overwrite:
-      print('Overwriting ...')
-  else:
-    overwrite = True
-
-  if overwrite:
-    url = f'https://s3.amazonaws.com/irs-form-990/index_{year}.json'
-    print('Requesting data from AWS ...')
-    r = requests.get(url)
-    if r.ok:
-      data = r.json()  # data is a dict with a single key
-      data = data['Filings' + str(year)]  # data is a list of dicts
-      # ignoring 990EZs and 990PFs
-      data = [d for d in data if d['FormType'] == '990']
-      print('Writing data to file.')
-      print(f'File contains data for {len(data)} organizations.')
-      with open(path, 'w') as f:
-        json.dump(data, f)
-    else:
+    print(f'File contains data for {n} organizations.')
+    return
+
+  if os.path.exists(path := get_index_path(year)) and not overwrite:
+    migrate_json_index(year, path)
+    return
+
+  url = f'{INDEX_URL}/index_{year}.json'
+  print('Requesting data from AWS ...')
+  with requests.get(url, stream=True) as r:
+    if not r.ok:
       raise FileNotFoundError(f'Index file for {year} not found on AWS.')
+    n = ingest_index(year, iter_entries(r.iter_content(CHUNK_SIZE)))
+  print(f'File contains data for {n} organizations.')
 
 
 def get_all_json_index(overwrite=False):
@@ -69,12 +261,14 @@ def get_all_json_index(overwrite=False):
 
 
 def get_index_years():
-  """Return list of years corresponding to cached index files."""
+  """Return list of years held in the index store.
 
-  index_path = os.path.join(get_data_path(), 'index')
-  years = os.listdir(index_path)
-  years.sort()
-  return [int(y.split('_')[1][:4]) for y in years]
+  Legacy json index files are moved into the store first, so data scraped
+  before the store existed is still found."""
+  migrate_json_indexes()
+  with contextlib.closing(connect()) as con:
+    rows = con.execute('SELECT year FROM years ORDER BY year').fetchall()
+  return [row[0] for row in rows]
 
 
 if __name__ == '__main__':
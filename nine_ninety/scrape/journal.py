@@ -0,0 +1,112 @@
+"""Record the outcome of every filing so interrupted scrapes resume exactly."""
+
+import os
+import json
+import sqlite3
+from nine_ninety.scrape.index import get_data_path, chunks
+
+
+JOURNAL_NAME = 'journal.sqlite'
+DONE = 'done'
+NOT_FOUND = '404'
+FAILED = 'failed'
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS progress (
+  object_id TEXT PRIMARY KEY,
+  status TEXT NOT NULL,
+  attempts INTEGER NOT NULL,
+  row TEXT
+) WITHOUT ROWID;
+"""
+
+
+def get_journal_path(year):
+  """Return path of the progress journal of year."""
+  path = os.path.join(get_data_path(), str(year))
+  if not os.path.exists(path):
+    os.makedirs(path)
+  return os.path.join(path, JOURNAL_NAME)
+
+
+class Journal:
+  """Durable record of each filing of a year as done, 404 or failed.
+
+  Every parsed filing is committed on its own to SQLite in WAL mode along
+  with its row of data, so a crash loses at most the filings in flight.
+  Rows are kept until their batch has been appended to the year's files;
+  failed filings keep empty data and can be fetched again later."""
+
+  def __init__(self, year):
+    self.year = year
+    self.con = sqlite3.connect(get_journal_path(year))
+    self.con.execute('PRAGMA journal_mode=WAL')
+    self.con.execute('PRAGMA synchronous=NORMAL')
+    self.con.executescript(SCHEMA)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    """Close the connection to the journal."""
+    self.con.close()
+
+  def record(self, org, status, row):
+    """Commit the status and parsed row of org."""
+    with self.con:
+      self.con.execute(
+          'INSERT INTO progress VALUES (?, ?, 1, ?) '
+          'ON CONFLICT (object_id) DO UPDATE SET status = excluded.status, '
+          'attempts = attempts + 1, row = excluded.row',
+          (org['ObjectId'], status, json.dumps(row)))
+
+  def statuses(self, orgs):
+    """Return a dict from object id to status for the recorded orgs."""
+    result = {}
+    for ids in chunks(org['ObjectId'] for org in orgs):
+      query = ('SELECT object_id, status FROM progress '
+               f'WHERE object_id IN ({", ".join("?" * len(ids))})')
+      result.update(self.con.execute(query, ids).fetchall())
+    return result
+
+  def unfinished(self, orgs):
+    """Return the orgs without any recorded outcome."""
+    statuses = self.statuses(orgs)
+    return [org for org in orgs if org['ObjectId'] not in statuses]
+
+  def rows(self, orgs):
+    """Return the recorded rows of orgs, in the order of orgs."""
+    rows = {}
+    for ids in chunks(org['ObjectId'] for org in orgs):
+      query = ('SELECT object_id, row FROM progress '
+               f'WHERE object_id IN ({", ".join("?" * len(ids))}) '
+               'AND row IS NOT NULL')
+      rows.update(self.con.execute(query, ids).fetchall())
+    if n_missing := sum(org['ObjectId'] not in rows for org in orgs):
+      raise KeyError(f'{n_missing} filings have no recorded row.')
+    return [json.loads(rows[org['ObjectId']]) for org in orgs]
+
+  def clear_rows(self, orgs=None):
+    """Drop the rows of orgs, or of every filing, once they are saved."""
+    with self.con:
+      if orgs is None:
+        self.con.execute('UPDATE progress SET row = NULL')
+        return
+      for ids in chunks(org['ObjectId'] for org in orgs):
+        self.con.execute('UPDATE progress SET row = NULL '
+                         f'WHERE object_id IN ({", ".join("?" * len(ids))})',
+                         ids)
+
+  def failed(self):
+    """Return the set of object ids whose requests failed."""
+    rows = self.con.execute('SELECT object_id FROM progress WHERE status = ?',
+                            (FAILED,)).fetchall()
+    return {row[0] for row in rows}
+
+  def summary(self):
+    """Return the number of filings recorded with each status."""
+    rows = self.con.execute('SELECT status, COUNT(*) FROM progress '
+                            'GROUP BY status').fetchall()
+    return dict(rows)
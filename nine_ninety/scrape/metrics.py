@@ -0,0 +1,196 @@
+"""Time each stage of the scrape and count what passes through it."""
+
+import os
+import time
+import json
+import bisect
+import datetime
+import contextlib
+from collections import Counter, defaultdict
+import aiohttp
+from nine_ninety.scrape.index import get_data_path
+
+
+# upper bounds in seconds, doubling from 10µs to about 84s
+BUCKETS = [1e-5 * 2 ** i for i in range(24)]
+# stages in the order a filing passes through them
+STAGES = ['dns', 'connect', 'ttfb', 'body', 'parse', 'verify', 'compress',
+          'journal', 'cast', 'write']
+PREFIX = 'nine_ninety'
+
+
+class Histogram:
+  """Count observations in fixed buckets, as in a Prometheus histogram."""
+
+  def __init__(self, buckets=BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)  # the last bucket is +Inf
+    self.count = 0
+    self.sum = 0.0
+
+  def observe(self, value):
+    """Record a single value."""
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.count += 1
+    self.sum += value
+
+  def quantile(self, q):
+    """Return the upper bound of the bucket holding quantile q."""
+    if not self.count:
+      return None
+    rank = q * self.count
+    cumulative = 0
+    for bound, n in zip(self.buckets + [float('inf')], self.counts):
+      cumulative += n
+      if cumulative >= rank:
+        return bound
+    return float('inf')
+
+  def to_dict(self):
+    """Return count, sum, quantiles and cumulative bucket counts."""
+    cumulative, buckets = 0, {}
+    for bound, n in zip(self.buckets + [float('inf')], self.counts):
+      cumulative += n
+      buckets[f'{bound:g}'] = cumulative
+    return {'count': self.count, 'sum': self.sum,
+            'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+            'buckets': buckets}
+
+
+def format_seconds(seconds):
+  """Return a short human readable duration."""
+  if seconds is None:
+    return '-'
+  if seconds == float('inf'):
+    return 'inf'
+  if seconds < 1:
+    return f'{1000 * seconds:.3g}ms'
+  return str(datetime.timedelta(seconds=round(seconds)))
+
+
+class Metrics:
+  """Histograms of stage timings and counters of events during a scrape.
+
+  Counters include statuses as status_<code>, retries, failures, bytes and
+  filings. Setting expected to the number of filings left gives an ETA."""
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    """Forget everything observed so far."""
+    self.stages = defaultdict(Histogram)
+    self.counters = Counter()
+    self.start = time.monotonic()
+    self.expected = None
+
+  def observe(self, stage, seconds):
+    """Record seconds spent in stage."""
+    self.stages[stage].observe(seconds)
+
+  def count(self, name, n=1):
+    """Increase the counter name by n."""
+    self.counters[name] += n
+
+  @contextlib.contextmanager
+  def timer(self, stage):
+    """Time the body of a with statement as stage."""
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(stage, time.perf_counter() - start)
+
+  def rate(self):
+    """Return filings handled per second since the start."""
+    elapsed = time.monotonic() - self.start
+    return self.counters['filings'] / elapsed if elapsed else 0.0
+
+  def eta(self):
+    """Return seconds left for the expected filings at the current rate."""
+    if self.expected is None:
+      return None
+    if not (rate := self.rate()):
+      return float('inf')
+    return max(0, self.expected - self.counters['filings']) / rate
+
+  def summary(self):
+    """Return a one line summary of throughput, stage latencies and counts."""
+    parts = [f'{self.counters["filings"]} filings', f'{self.rate():.1f}/s',
+             f'ETA {format_seconds(self.eta())}']
+    for stage in sorted(self.stages, key=stage_order):
+      h = self.stages[stage]
+      parts.append(f'{stage} p50 {format_seconds(h.quantile(0.5))} '
+                   f'p99 {format_seconds(h.quantile(0.99))}')
+    parts.append(f'{self.counters["bytes"] / 2 ** 20:.0f}MB')
+    parts += [f'{k}={v}' for k, v in sorted(self.counters.items())
+              if k not in ('filings', 'bytes')]
+    return ' | '.join(parts)
+
+  def to_dict(self):
+    """Return all metrics as a dict ready for json."""
+    return {'elapsed': time.monotonic() - self.start, 'rate': self.rate(),
+            'eta': self.eta(), 'expected': self.expected,
+            'counters': dict(self.counters),
+            'stages': {k: h.to_dict() for k, h in self.stages.items()}}
+
+  def to_prometheus(self):
+    """Return all metrics in the Prometheus text exposition format."""
+    lines = [f'# TYPE {PREFIX}_events_total counter']
+    for k, v in sorted(self.counters.items()):
+      lines.append(f'{PREFIX}_events_total{{event="{k}"}} {v}')
+    lines.append(f'# TYPE {PREFIX}_stage_seconds histogram')
+    for stage in sorted(self.stages, key=stage_order):
+      h = self.stages[stage].to_dict()
+      for bound, n in h['buckets'].items():
+        bound = '+Inf' if bound == 'inf' else bound
+        lines.append(f'{PREFIX}_stage_seconds_bucket'
+                     f'{{stage="{stage}",le="{bound}"}} {n}')
+      lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {h["sum"]}')
+      lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} '
+                   f'{h["count"]}')
+    if (eta := self.eta()) is not None and eta != float('inf'):
+      lines.append(f'# TYPE {PREFIX}_eta_seconds gauge')
+      lines.append(f'{PREFIX}_eta_seconds {eta}')
+    return '\n'.join(lines) + '\n'
+
+  def dump(self, path=None):
+    """Atomically write metrics.json and metrics.prom into path."""
+    path = path or get_data_path()
+    for name, text in [('metrics.json', json.dumps(self.to_dict(), indent=2)),
+                       ('metrics.prom', self.to_prometheus())]:
+      file_path = os.path.join(path, name)
+      with open(file_path + '.tmp', 'w') as f:
+        f.write(text)
+      os.replace(file_path + '.tmp', file_path)
+
+
+def stage_order(stage):
+  """Sort key listing known stages in pipeline order."""
+  return (STAGES.index(stage) if stage in STAGES else len(STAGES), stage)
+
+
+def make_trace(metrics):
+  """Return an aiohttp trace timing DNS, connecting and time to first byte."""
+  trace = aiohttp.TraceConfig()
+
+  def start(name):
+    async def on_start(session, context, params):
+      setattr(context, name, time.perf_counter())
+    return on_start
+
+  def end(name, stage):
+    async def on_end(session, context, params):
+      metrics.observe(stage, time.perf_counter() - getattr(context, name))
+    return on_end
+
+  trace.on_dns_resolvehost_start.append(start('dns_start'))
+  trace.on_dns_resolvehost_end.append(end('dns_start', 'dns'))
+  trace.on_connection_create_start.append(start('connect_start'))
+  trace.on_connection_create_end.append(end('connect_start', 'connect'))
+  trace.on_request_start.append(start('request_start'))
+  trace.on_request_end.append(end('request_start', 'ttfb'))
+  return trace
+
+
+METRICS = Metrics()  # shared by everything running in the scraping process
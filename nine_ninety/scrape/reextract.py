@@ -0,0 +1,148 @@
+"""Re-extract only the columns whose xpaths changed since a year was saved."""
+
+import os
+import asyncio
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from tqdm import tqdm
+from nine_ninety.scrape.utils import OFFICERS, to_frame, get_fingerprints
+from nine_ninety.scrape.utils import load_fingerprints, save_fingerprints
+from nine_ninety.scrape import storage
+from nine_ninety.scrape.writer import write_file_manifest
+from nine_ninety.scrape.archive import RawArchive, parse_archived
+from nine_ninety.scrape.index import get_data_path, get_index_years, load_index
+from nine_ninety.scrape.index import get_object_ids
+from nine_ninety.scrape.scrape import BATCH_SIZE, PARSE_WORKERS
+from nine_ninety.scrape.scrape import STREAMING_PARSE
+from nine_ninety.scrape.scrape import make_limiter, make_session, run_pipeline
+
+
+def get_year_csv(year):
+  """Return path of the bundled csv for year."""
+  return os.path.join(get_data_path(), str(year), f'{year}.csv')
+
+
+def saved_fingerprints(year):
+  """Return recorded fingerprints for year.
+
+  Datasets saved before fingerprints were recorded are assumed to have been
+  built with the current xpaths for every column they contain."""
+  if (saved := load_fingerprints(year)) is not None:
+    return saved
+  print(f'No xpath fingerprints saved for {year}; '
+        'assuming existing columns are current.')
+  columns = pd.read_csv(get_year_csv(year), nrows=0).columns
+  current = get_fingerprints()
+  return {k: current[k] for k in columns if k in current}
+
+
+def stale_keys(year):
+  """Return keys added or changed in xpath_headers since year was saved."""
+  current = get_fingerprints()
+  saved = saved_fingerprints(year)
+  keys = [k for k in current if saved.get(k) != current[k]]
+  # officer salaries are always extracted together
+  if set(keys) & set(OFFICERS):
+    keys = [k for k in keys if k not in OFFICERS] + OFFICERS
+  return keys
+
+
+def archive_is_complete(year):
+  """Determine if every filing indexed for year is held in the raw archive."""
+  with RawArchive(year) as archive:
+    return all(i in archive for i in get_object_ids(year))
+
+
+def extract_from_archive(year, keys):
+  """Extract keys for every org indexed for year from the raw archive.
+
+  As in parse_from_archive, the index and blobs are read in slices of
+  BATCH_SIZE orgs so only the rows extracted are held for the whole year."""
+  n = len(get_object_ids(year))
+  rows = []
+  with RawArchive(year) as archive:
+    with ProcessPoolExecutor(PARSE_WORKERS) as pool:
+      with tqdm(total=n) as progress:
+        for start in range(0, n, BATCH_SIZE):
+          orgs = load_index(year, start, start + BATCH_SIZE)
+          blobs = [archive.read_compressed(org['ObjectId']) for org in orgs]
+          rows.extend(pool.map(parse_archived, blobs, orgs,
+                               repeat(STREAMING_PARSE), repeat(keys),
+                               chunksize=32))
+          progress.update(len(orgs))
+  return rows
+
+
+def extract_from_requests(index, keys):
+  """Extract keys for every org in index by fetching filings again."""
+
+  async def run():
+    with ProcessPoolExecutor(PARSE_WORKERS) as pool:
+      async with make_session() as session:
+        return await run_pipeline(index, session, pool, make_limiter(),
+                                  keys=keys)
+
+  return asyncio.run(run())
+
+
+def merge_columns(df, new, keys):
+  """Replace or add keys in df with columns from new, aligned by row."""
+  if len(df) != len(new):
+    raise ValueError(f'len(df) = {len(df)} whereas len(new) = {len(new)}')
+
+  old_ein = pd.to_numeric(df['ein'], errors='coerce').fillna(0).values
+  new_ein = pd.to_numeric(new['ein'], errors='coerce').fillna(0).values
+  if n := ((old_ein != 0) & (new_ein != 0) & (old_ein != new_ein)).sum():
+    raise ValueError(f'{n} re-extracted rows do not line up with saved data!')
+  if n := ((old_ein != 0) & (new_ein == 0)).sum():
+    print(f'Warning: {n} filings could not be re-extracted and are set to 0.')
+
+  for k in keys:
+    df[k] = new[k].values
+  order = [k for k in get_fingerprints() if k in df.columns]
+  return df[order + [k for k in df.columns if k not in order]]
+
+
+def reextract_year(year, keys=None, source=None):
+  """Re-extract keys for year and merge them into its saved csv.
+
+  By default keys are the stale columns of the year. The source is either
+  'archive' or 'fetch'; by default the archive is used when complete."""
+  if keys is None:
+    keys = stale_keys(year)
+  if not keys:
+    print(f'Data for {year} is up to date with xpath_headers.csv.')
+    return
+
+  if source is None:
+    source = 'archive' if archive_is_complete(year) else 'fetch'
+  print(f'Re-extracting {keys} for {year} from {source} ...')
+  extract_keys = list(dict.fromkeys(['ein'] + list(keys)))
+  if source == 'archive':
+    rows = extract_from_archive(year, extract_keys)
+  elif source == 'fetch':
+    rows = extract_from_requests(load_index(year), extract_keys)
+  else:
+    raise ValueError('source must be "archive" or "fetch".')
+  new = to_frame(rows)
+
+  path = get_year_csv(year)
+  df = merge_columns(pd.read_csv(path), new, keys)
+  tmp_path = path + '.tmp'
+  df.to_csv(tmp_path, index=False)
+  os.replace(tmp_path, path)
+  write_file_manifest(year, len(df))
+  storage.write_year(df, year)
+
+  fingerprints = saved_fingerprints(year)
+  current = get_fingerprints()
+  fingerprints.update({k: current[k] for k in keys})
+  save_fingerprints(year, fingerprints)
+  print(f'Updated {len(keys)} columns of {year}.')
+
+
+if __name__ == '__main__':
+  for y in get_index_years():
+    if os.path.exists(get_year_csv(y)):
+      reextract_year(y)
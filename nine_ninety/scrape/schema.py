@@ -0,0 +1,22 @@
+"""Columns extracted from 990 XML as specified in xpath_headers.csv."""
+
+import io
+import pkgutil
+import pandas as pd
+
+
+xp_bytes = pkgutil.get_data(__name__, '../xpath_headers.csv')
+if xp_bytes is None:
+  raise FileNotFoundError('Issue reading xpath_headers.csv')
+XP = pd.read_csv(io.BytesIO(xp_bytes))
+NEW_PATHS = dict(zip(list(XP['key']), list(XP['new_xpath'])))
+OLD_PATHS = dict(zip(list(XP['key']), list(XP['old_xpath'])))
+DATA_TYPES = dict(zip(list(XP['key']), list(XP['data_type'])))
+OFFICERS = [f'officer_{i}' for i in range(5)]
+DATA_TYPES.update(dict(zip(OFFICERS, ['int'] * 5)))
+OFFICERS_KEY = 'officers'
+OFFICER_PATHS = {
+    'old': ('ReturnData/IRS990/Form990PartVIISectionA'
+            '/ReportableCompFromOrganization'),
+    'new': ('ReturnData/IRS990/Form990PartVIISectionAGrp'
+            '/ReportableCompFromOrgAmt')}
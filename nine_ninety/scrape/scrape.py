@@ -1,111 +1,424 @@
 """Make asynchronous requests with aiohttp."""
 
 import os
-import json
+import sys
 import time
+import random
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
 import aiohttp
-from tqdm import trange
-from nine_ninety.scrape.utils import parse, save_as_csv, verify, empty_data
-from nine_ninety.scrape.utils import bundle_year, confirm_year, clean_year
+import pandas as pd
+from tqdm import tqdm, trange
+from nine_ninety.scrape.utils import timed_parse_filing, to_frame
+from nine_ninety.scrape.concurrency import AdaptiveLimiter
+from nine_ninety.scrape.metrics import METRICS, make_trace
+from nine_ninety.scrape.utils import confirm_year, save_fingerprints
+from nine_ninety.scrape.utils import save_snapshot
+from nine_ninety.scrape.writer import YearWriter, load_manifest
+from nine_ninety.scrape.writer import year_is_committed
+from nine_ninety.scrape.writer import write_file_manifest
+from nine_ninety.scrape import storage
+from nine_ninety.scrape.archive import RawArchive, parse_archived
+from nine_ninety.scrape.archive import timed_parse_archiving
+from nine_ninety.scrape.journal import Journal, DONE, NOT_FOUND, FAILED
 from nine_ninety.scrape.index import get_index_years, get_all_json_index, get_data_path
+from nine_ninety.scrape.index import load_index, count_index
+from nine_ninety.scrape.index import get_object_ids
 
 
-SESSIONS_PER_BATCH = 20
-SESSION_SIZE = 50
+BATCH_SIZE = 1000  # organizations per saved csv batch
+MIN_IN_FLIGHT = 4  # bounds on the adaptive window of concurrent requests
+MAX_IN_FLIGHT = 200
+INITIAL_IN_FLIGHT = 50
+MAX_RETRIES = 8
+BASE_BACKOFF = 0.5  # seconds before the first retry, doubling afterwards
+MAX_BACKOFF = 60
+REQUEST_TIMEOUT = 120
+STREAMING_PARSE = False  # match xpaths from parser events instead of a tree
+ARCHIVE_RAW = False  # keep compressed raw XML to re-extract without requests
+PARSE_WORKERS = os.cpu_count() or 1
+PARSE_QUEUE_SIZE = 4 * PARSE_WORKERS  # raw XML waiting for a free parser
+ACTIVE_YEARS = 3  # years downloading at once through one request budget
+TRACE_CONFIGS = []  # aiohttp.TraceConfig hooks, e.g. from a benchmark
+REPORT_INTERVAL = 60  # seconds between metric summaries and dumps
+
+
+def make_limiter():
+  """Create the controller adapting the number of in-flight requests."""
+  return AdaptiveLimiter(MIN_IN_FLIGHT, MAX_IN_FLIGHT, INITIAL_IN_FLIGHT)
+
+
+def make_session():
+  """Create the single pooled session reused for every request."""
+  connector = aiohttp.TCPConnector(limit=MAX_IN_FLIGHT,
+                                   limit_per_host=MAX_IN_FLIGHT,
+                                   ttl_dns_cache=300,
+                                   keepalive_timeout=60,
+                                   ssl=False)
+  timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+  return aiohttp.ClientSession(connector=connector, timeout=timeout,
+                               trace_configs=[make_trace(METRICS)] +
+                               TRACE_CONFIGS)
 
 
 async def fetch(org, session):
-  """Request 990 XML data from org."""
+  """Request 990 XML data from org, returning raw bytes or None for 404s."""
 
-  async with session.get(org['URL'], ssl=False) as response:
+  async with session.get(org['URL']) as response:
+    METRICS.count(f'status_{response.status}')
     if response.status == 404:
-      return empty_data()
+      return None
 
     if response.status != 200:
       print(f'Received response with status: {response.status}')
       raise aiohttp.ClientConnectionError
 
-    xml = await response.read()
-    data = parse(xml)
-    verify(data, org)
-    return data
+    with METRICS.timer('body'):
+      xml = await response.read()
+    METRICS.count('bytes', len(xml))
+    return xml
 
 
-async def run_session(orgs):
-  """Run a single asynchronous request session."""
-  tasks = []
-  async with aiohttp.ClientSession() as session:
-    for org in orgs:
-      task = asyncio.ensure_future(fetch(org, session))
-      tasks.append(task)
-    responses = asyncio.gather(*tasks)
-    await responses
-  return responses
+def backoff_delay(attempt):
+  """Exponential backoff with full jitter for the given retry attempt."""
+  return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
 
 
-def run_batch(orgs, csv_path):
-  """Fetch and save data from orgs."""
+async def fetch_with_retry(org, session, limiter):
+  """Fetch org, retrying only this request after connection errors.
 
+  Every attempt reports its latency or failure to limiter."""
+  for attempt in range(MAX_RETRIES):
+    start = time.perf_counter()
+    try:
+      xml = await fetch(org, session)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+      limiter.record_failure()
+      if attempt == MAX_RETRIES - 1:
+        raise e
+      METRICS.count('retries')
+      await asyncio.sleep(backoff_delay(attempt))
+    else:
+      limiter.record_success(time.perf_counter() - start)
+      return xml
+
+
+async def download(i, org, session, queue, limiter, failures):
+  """Download a single org and queue its raw XML for parsing."""
+  try:
+    xml = await fetch_with_retry(org, session, limiter)
+  except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+    print(f'Giving up on {org["URL"]} after {MAX_RETRIES} attempts: {e!r}')
+    failures.append(org)
+    METRICS.count('failures')
+    xml, status = None, FAILED
+  else:
+    status = DONE if xml is not None else NOT_FOUND
   try:
-    batch = []
-    for j in trange(SESSIONS_PER_BATCH):
-      loop = asyncio.get_event_loop()
-      asyncio.set_event_loop(loop)
-      orgs_slice = orgs[j * SESSION_SIZE: (j + 1) * SESSION_SIZE]
-      task = asyncio.ensure_future(run_session(orgs_slice))
-      loop.run_until_complete(task)
-      result = task.result().result()
-      batch += result
-    assert len(batch) == len(orgs)
-    save_as_csv(batch, csv_path)
-
-  except (aiohttp.ClientError, asyncio.exceptions.TimeoutError) as e:
-    print(e)
-    time.sleep(10)
-    run_batch(orgs, csv_path)
+    # blocks while parsers are behind, holding back the next downloads
+    await queue.put((i, org, xml, status))
+  finally:
+    limiter.release()
 
 
-def determine_missing_batches(year, total_n_batch):
-  """Determine the batch files currently missing."""
+async def parse_worker(queue, pool, results, progress, keys=None,
+                       journal=None, archive=None):
+  """Hand queued XML to the process pool and store parsed data in results.
+
+  If archive is given, each fetched filing is compressed in pool along with
+  parsing, then stored and flushed there. If journal is given, each parsed
+  filing is then recorded with its status, so a filing is never recorded
+  without being archived."""
+  loop = asyncio.get_running_loop()
+  while True:
+    i, org, xml, status = await queue.get()
+    try:
+      if archive is None:
+        results[i], timings = await loop.run_in_executor(
+            pool, timed_parse_filing, xml, org, STREAMING_PARSE, keys)
+      else:
+        results[i], timings, blob = await loop.run_in_executor(
+            pool, timed_parse_archiving, xml, org, STREAMING_PARSE, keys)
+      for stage, seconds in timings.items():
+        METRICS.observe(stage, seconds)
+      METRICS.count('filings')
+      if archive is not None and status != FAILED:
+        archive.append_compressed(org, blob)
+        archive.flush()
+      if journal is not None:
+        with METRICS.timer('journal'):
+          journal.record(org, status, results[i])
+    except Exception as e:
+      results[i] = e  # raised once the queue drains
+    finally:
+      progress.update()
+      queue.task_done()
+
+
+async def run_pipeline(orgs, session, pool, limiter, archive=None, keys=None,
+                       journal=None, progress=None):
+  """Download orgs on the event loop while parsing them in pool.
+
+  If archive is given, raw XML is also stored there as it is parsed. If keys
+  is given, only those columns are extracted. If journal is given, the
+  outcome of every filing is recorded as soon as it is parsed. If progress
+  is given, that bar is updated instead of a new one for orgs."""
+  queue = asyncio.Queue(PARSE_QUEUE_SIZE)
+  results = [None] * len(orgs)
+  failures = []
+  own_progress = progress is None
+  if own_progress:
+    progress = tqdm(total=len(orgs))
+  parsers = [
+      asyncio.ensure_future(
+          parse_worker(queue, pool, results, progress, keys, journal,
+                       archive))
+      for _ in range(PARSE_WORKERS)]
+  downloads = []
+  try:
+    for i, org in enumerate(orgs):
+      await limiter.acquire()
+      progress.set_postfix(limiter.summary(), refresh=False)
+      downloads.append(asyncio.ensure_future(
+          download(i, org, session, queue, limiter, failures)))
+    await asyncio.gather(*downloads)
+    await queue.join()
+  finally:
+    for task in parsers + downloads:
+      task.cancel()
+    if own_progress:
+      progress.close()
 
-  path = os.path.join(get_data_path(), str(year))
-  if not os.path.exists(path):
-    os.mkdir(path)
-  batches = os.listdir(path)
+  if failures:
+    tqdm.write(f'Recorded {len(failures)} failed requests as empty data.')
+  for result in results:
+    if isinstance(result, Exception):
+      raise result
+  return results
 
-  batches = [int(b.split('.')[0]) for b in batches]
-  if year in batches:
+
+async def run_batch(orgs, n_batch, writer, journal, session, pool, limiter,
+                    archive=None, progress=None):
+  """Fetch the orgs missing from journal and append the batch with writer.
+
+  With an archive, filings recorded in the journal but missing from the
+  archive, as left by a scrape killed before flushing it, are fetched again."""
+  statuses = journal.statuses(orgs)
+  todo = [org for org in orgs if (status := statuses.get(org['ObjectId']))
+          is None or (archive is not None and status != FAILED and
+                      org['ObjectId'] not in archive)]
+  if todo:
+    await run_pipeline(todo, session, pool, limiter, archive, journal=journal,
+                       progress=progress)
+  with METRICS.timer('cast'):
+    df = to_frame(journal.rows(orgs))
+  with METRICS.timer('write'):
+    writer.append(n_batch, df)
+  journal.clear_rows(orgs)
+
+
+async def run_batches(year, batches, writer, journal, session, pool, limiter,
+                      progress=None):
+  """Run batches from year through a shared session and parser pool."""
+  archive = RawArchive(year, 'a') if ARCHIVE_RAW else None
+  try:
+    for n_batch in batches:
+      orgs = load_index(year, n_batch * BATCH_SIZE,
+                        (n_batch + 1) * BATCH_SIZE)
+      await run_batch(orgs, n_batch, writer, journal, session, pool, limiter,
+                      archive, progress)
+  finally:
+    if archive is not None:
+      archive.close()
+
+
+def determine_missing_batches(year, total_n_batch):
+  """Determine the batches not yet recorded in the manifest of year.
+
+  This is empty both for a committed year and for a year whose batches were
+  all written but whose commit was interrupted."""
+  if year_is_committed(year):
     print(f'Seem to already have data for {year}')
     return []
 
-  return [i for i in range(total_n_batch + 1) if i not in batches]
+  manifest = load_manifest(year)
+  batches = set() if manifest is None else set(manifest['batches'])
+  return [i for i in range(total_n_batch + 1) if str(i) not in batches]
+
+
+def commit_year(year, writer, n_index):
+  """Move the data of a finished year into place and confirm it."""
+  writer.commit(n_index)
+  save_fingerprints(year)
+  confirm_year(year)
+  save_snapshot(year)
+
+
+def finish_year(year, writer, n_index):
+  """Commit a fully journalled year and drop the rows kept in its journal."""
+  commit_year(year, writer, n_index)
+  with Journal(year) as journal:
+    journal.clear_rows()
+    print(f'Filings by status in {year}: {journal.summary()}')
+
+
+async def scrape_year(year, session, pool, limiter, slots):
+  """Fetch the unfinished filings of year once one of slots is free.
+
+  Each filing is recorded in the journal of the year as it is parsed, so an
+  interrupted run resumes with the filings that were still unfinished. The
+  slot is handed to the next year before the finished year is committed in
+  a thread, so its post-processing overlaps with the next downloads."""
+  if (n_index := count_index(year)) is None:
+    raise FileNotFoundError(f'No index stored for {year}.')
+  total_n_batch = n_index // BATCH_SIZE
+  if year_is_committed(year):
+    return
+  # when empty, the batches are all written and only the commit is left
+  missing_batches = determine_missing_batches(year, total_n_batch)
+
+  position = await slots.get()
+  try:
+    writer = YearWriter(year)
+    with Journal(year) as journal:
+      n_done = sum(journal.summary().values())
+      with tqdm(total=n_index, initial=n_done, desc=str(year),
+                position=position) as progress:
+        await run_batches(year, missing_batches, writer, journal, session,
+                          pool, limiter, progress)
+  finally:
+    slots.put_nowait(position)
+
+  tqdm.write(f'Fetched all data from {year}!')
+  loop = asyncio.get_running_loop()
+  await loop.run_in_executor(None, finish_year, year, writer, n_index)
+
+
+def count_unfinished(year):
+  """Return the number of filings of year without a recorded outcome."""
+  if year_is_committed(year):
+    return 0
+  with Journal(year) as journal:
+    return (count_index(year) or 0) - sum(journal.summary().values())
+
+
+async def report_metrics():
+  """Periodically print a summary of the metrics and dump them to disk."""
+  while True:
+    await asyncio.sleep(REPORT_INTERVAL)
+    tqdm.write(METRICS.summary())
+    METRICS.dump()
+
+
+async def run_years(years):
+  """Fetch years concurrently through one session, parser pool and limiter.
+
+  At most ACTIVE_YEARS years download at once, all drawing requests from
+  the same adaptive window. Metrics are summarized and written to
+  metrics.json and metrics.prom in the data directory every
+  REPORT_INTERVAL seconds."""
+  limiter = make_limiter()
+  slots = asyncio.Queue()
+  for position in range(ACTIVE_YEARS):
+    slots.put_nowait(position)  # also the line of the year's progress bar
+  METRICS.reset()
+  METRICS.expected = sum(count_unfinished(year) for year in years)
+  reporter = asyncio.ensure_future(report_metrics())
+  try:
+    with ProcessPoolExecutor(PARSE_WORKERS) as pool:
+      async with make_session() as session:
+        await asyncio.gather(*[scrape_year(year, session, pool, limiter,
+                                           slots) for year in years])
+  finally:
+    reporter.cancel()
+    METRICS.dump()
+  print(f'Concurrency at the end: {limiter.summary()}')
+  print(METRICS.summary())
 
 
 def run_year(year):
   """Fetch and save data from a specific year."""
-  index_path = os.path.join(get_data_path(), 'index', f'index_{year}.json')
-  with open(index_path) as f:
-    index = json.load(f)
-  total_n_batch = len(index) // (SESSION_SIZE * SESSIONS_PER_BATCH)
-  assert len(str(total_n_batch)) < 4  # for left padding below
+  asyncio.run(run_years([year]))
 
-  missing_batches = determine_missing_batches(year, total_n_batch)
-  for n_batch in missing_batches:
-    print(f'Running batch {n_batch} / {total_n_batch} in year {year}')
-    csv_name = f'{n_batch:03}' + '.csv'
-    csv_path = os.path.join(get_data_path(), str(year), csv_name)
-    batch_size = SESSION_SIZE * SESSIONS_PER_BATCH
-    orgs = index[n_batch * batch_size: (n_batch + 1) * batch_size]
-    run_batch(orgs, csv_path)
-  if missing_batches:
-    print(f'Fetched all data from {year}!')
-    bundle_year(year)
-    confirm_year(year)
-    clean_year(year)
+
+def patch_year(year, positions, rows):
+  """Replace the rows of year at index positions with newly parsed rows."""
+  path = os.path.join(get_data_path(), str(year), f'{year}.csv')
+  df = pd.read_csv(path)
+  new = to_frame(rows)
+  for k in new.columns:
+    if df[k].dtype != new[k].dtype:
+      df[k] = df[k].astype(object)  # e.g. a column read from csv as all ints
+    df.loc[positions, k] = new[k].values
+  tmp_path = path + '.tmp'
+  df.to_csv(tmp_path, index=False)
+  os.replace(tmp_path, path)
+  write_file_manifest(year, len(df))
+  storage.write_year(df, year)
+  confirm_year(year)
+
+
+def retry_failed(year):
+  """Fetch the failed filings of a finished year again and patch its data."""
+  manifest = load_manifest(year)
+  if manifest is None or not manifest['complete']:
+    print(f'Finish scraping {year} before retrying its failures.')
+    return
+
+  with Journal(year) as journal:
+    if not (failed := journal.failed()):
+      print(f'No failed filings recorded for {year}.')
+      return
+    positions = [i for i, object_id in enumerate(get_object_ids(year))
+                 if object_id in failed]
+    orgs = [load_index(year, i, i + 1)[0] for i in positions]
+    print(f'Retrying {len(orgs)} failed filings from {year} ...')
+
+    async def run():
+      with ProcessPoolExecutor(PARSE_WORKERS) as pool:
+        async with make_session() as session:
+          await run_pipeline(orgs, session, pool, make_limiter(),
+                             journal=journal)
+
+    asyncio.run(run())
+    statuses = journal.statuses(orgs)
+    fixed = [(i, org) for i, org in zip(positions, orgs)
+             if statuses[org['ObjectId']] != FAILED]
+    if fixed:
+      fixed_positions, fixed_orgs = zip(*fixed)
+      patch_year(year, list(fixed_positions), journal.rows(fixed_orgs))
+    journal.clear_rows(orgs)
+    print(f'Recovered {len(fixed)} of {len(orgs)} failed filings.')
+
+
+def parse_from_archive(year):
+  """Re-extract data for year from the raw archive without any requests."""
+  object_ids = get_object_ids(year)
+  total_n_batch = len(object_ids) // BATCH_SIZE
+
+  with RawArchive(year) as archive:
+    if n_missing := sum(i not in archive for i in object_ids):
+      raise FileNotFoundError(
+          f'{n_missing} filings from {year} are missing from the raw archive.')
+
+    print(f'Parsing {len(object_ids)} archived filings from {year} ...')
+    writer = YearWriter(year, overwrite=True)
+    with ProcessPoolExecutor(PARSE_WORKERS) as pool:
+      for n_batch in trange(total_n_batch + 1):
+        orgs = load_index(year, n_batch * BATCH_SIZE,
+                          (n_batch + 1) * BATCH_SIZE)
+        blobs = [archive.read_compressed(org['ObjectId']) for org in orgs]
+        streaming = [STREAMING_PARSE] * len(orgs)
+        batch = list(pool.map(parse_archived, blobs, orgs, streaming,
+                              chunksize=32))
+        writer.append(n_batch, to_frame(batch))
+  commit_year(year, writer, len(object_ids))
 
 
 if __name__ == '__main__':
   get_all_json_index()
-  for year in get_index_years():
-    run_year(year)
+  if '--retry-failed' in sys.argv:
+    for year in get_index_years():
+      retry_failed(year)
+  else:
+    asyncio.run(run_years(get_index_years()))
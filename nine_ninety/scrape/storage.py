@@ -0,0 +1,148 @@
+"""Store yearly 990 data as typed, columnar parquet partitioned by year."""
+
+import os
+import glob
+import shutil
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pandas as pd
+from nine_ninety.scrape.index import get_data_path, get_index_years
+from nine_ninety.scrape.schema import DATA_TYPES
+
+
+ROW_GROUP_SIZE = 50000  # rows per row group, the unit skipped by filters
+ARROW_TYPES = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string(),
+               'bool': pa.bool_()}
+# pd.read_csv has always turned EINs into integers, so they are kept that way
+TYPE_OVERRIDES = {'ein': pa.int64()}
+
+
+def get_parquet_root():
+  """Return the root directory of the parquet dataset."""
+  return os.path.join(get_data_path(), 'parquet')
+
+
+def get_parquet_dir(year, staging=False):
+  """Return directory of the parquet parts holding data from year."""
+  name = f'year={year}' + ('.partial' if staging else '')
+  return os.path.join(get_parquet_root(), name)
+
+
+def get_parts(year, staging=False):
+  """Return sorted paths of the parquet parts of year."""
+  return sorted(glob.glob(os.path.join(get_parquet_dir(year, staging),
+                                       'part-*.parquet')))
+
+
+def has_year(year):
+  """Determine if parquet data exists for year."""
+  return bool(get_parts(year))
+
+
+def get_schema(columns):
+  """Return arrow schema for columns based on DATA_TYPES."""
+  fields = []
+  for k in columns:
+    arrow_type = TYPE_OVERRIDES.get(k, ARROW_TYPES[DATA_TYPES[k]])
+    fields.append(pa.field(k, arrow_type))
+  return pa.schema(fields)
+
+
+def to_table(df):
+  """Convert DataFrame with csv style columns into a typed arrow table."""
+  df = df.copy()
+  for k in df.columns:
+    if DATA_TYPES[k] == 'bool':
+      df[k] = df[k].astype(bool)
+    elif k in TYPE_OVERRIDES:
+      df[k] = pd.to_numeric(df[k])
+  return pa.Table.from_pandas(df, schema=get_schema(df.columns),
+                              preserve_index=False)
+
+
+def write_part(df, year, n_part, staging=False):
+  """Write DataFrame as a numbered parquet part of year."""
+  name = f'part-{n_part:03}.parquet'
+  path = os.path.join(get_parquet_dir(year, staging), name)
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmp_path = path + '.tmp'
+  pq.write_table(to_table(df), tmp_path, row_group_size=ROW_GROUP_SIZE,
+                 compression='zstd')
+  os.replace(tmp_path, path)
+
+
+def commit_parts(year, n_parts):
+  """Replace parquet data of year with the first n_parts staged parts."""
+  staging = get_parquet_dir(year, staging=True)
+  for path in get_parts(year, staging=True)[n_parts:]:
+    os.remove(path)  # left by a batch interrupted before it was recorded
+  final = get_parquet_dir(year)
+  if os.path.exists(final):
+    shutil.rmtree(final)
+  os.rename(staging, final)
+
+
+def clear_staging(year):
+  """Remove any staged parquet parts of year."""
+  if os.path.exists(staging := get_parquet_dir(year, staging=True)):
+    shutil.rmtree(staging)
+
+
+def write_year(df, year):
+  """Write DataFrame of year to parquet, replacing any previous data."""
+  clear_staging(year)
+  write_part(df, year, 0, staging=True)
+  commit_parts(year, 1)
+
+
+def read_years(years, columns=None, filters=None):
+  """Read data from years into a DataFrame.
+
+  Only columns are read from disk, and filters, given as a list of
+  (column, op, value) tuples, skip row groups using their statistics."""
+  paths = [path for y in years for path in get_parts(y)]
+  dataset = ds.dataset(paths, format='parquet')
+  expression = None if not filters else pq.filters_to_expression(filters)
+  table = dataset.to_table(columns=columns, filter=expression)
+  return table.to_pandas()
+
+
+def apply_filters(df, filters):
+  """Apply (column, op, value) filters to a DataFrame read from csv."""
+  ops = {'=': '__eq__', '==': '__eq__', '!=': '__ne__', '<': '__lt__',
+         '<=': '__le__', '>': '__gt__', '>=': '__ge__'}
+  mask = pd.Series(True, index=df.index)
+  for column, op, value in filters or []:
+    if op == 'in':
+      mask &= df[column].isin(value)
+    elif op == 'not in':
+      mask &= ~df[column].isin(value)
+    else:
+      mask &= getattr(df[column], ops[op])(value)
+  return df[mask]
+
+
+def convert_csv(year):
+  """Write parquet data for year from its bundled csv."""
+  csv_path = os.path.join(get_data_path(), str(year), f'{year}.csv')
+  print(f'Converting {csv_path} to parquet ...')
+  write_year(pd.read_csv(csv_path), year)
+
+
+def export_csv(year, csv_path=None):
+  """Export parquet data for year in the csv layout produced by the scraper."""
+  if csv_path is None:
+    csv_path = os.path.join(get_data_path(), str(year), f'{year}.csv')
+  df = read_years([year])
+  for k in df.columns:
+    if DATA_TYPES[k] == 'bool':
+      df[k] = df[k].astype(int)
+  df.to_csv(csv_path, index=False)
+  return csv_path
+
+
+if __name__ == '__main__':
+  for y in get_index_years():
+    if not has_year(y):
+      convert_csv(y)
@@ -1,80 +1,133 @@
 """Parse and save utilities."""
 
 import os
+import time
 import json
-import pkgutil
-import io
+import functools
+import operator
+import hashlib
 from lxml import etree
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
 from nine_ninety.scrape.index import get_data_path, get_index_years
+from nine_ninety.scrape.index import count_index
+from nine_ninety.scrape.schema import XP, NEW_PATHS, OLD_PATHS, DATA_TYPES
+from nine_ninety.scrape.schema import OFFICERS, OFFICERS_KEY, OFFICER_PATHS
+from nine_ninety.scrape.extract import compile_paths, default_namespace
+from nine_ninety.scrape.extract import extract, stream_extract
+from nine_ninety.scrape import storage
+from nine_ninety.scrape.writer import load_manifest, get_manifest_path
 
 
-xp_bytes = pkgutil.get_data(__name__, '../xpath_headers.csv')
-if xp_bytes is None:
-  raise FileNotFoundError('Issue reading xpath_headers.csv')
-XP = pd.read_csv(io.BytesIO(xp_bytes))
-NEW_PATHS = dict(zip(list(XP['key']), list(XP['new_xpath'])))
-OLD_PATHS = dict(zip(list(XP['key']), list(XP['old_xpath'])))
-DATA_TYPES = dict(zip(list(XP['key']), list(XP['data_type'])))
-OFFICERS = [f'officer_{i}' for i in range(5)]
-DATA_TYPES.update(dict(zip(OFFICERS, ['int'] * 5)))
+SNAPSHOT_VERSION = 1  # bump whenever fix_mistakes changes its output
 
 
-def empty_data():
+def empty_data(keys=None):
   """Return dictionary of all 0s to use with 404 responses."""
-  keys = list(NEW_PATHS.keys()) + OFFICERS
+  if keys is None:
+    keys = list(NEW_PATHS.keys()) + OFFICERS
   return dict(zip(keys, [0] * len(keys)))
 
 
-def parse(xml):
-  """Grab values from xml based on xpath_headers."""
-  data = {}
-  root = etree.XML(xml)
+def get_version_year(attrib):
+  """Return the year of the schema version from attributes of the root."""
+  return int(attrib['returnVersion'].split('v')[0])
 
-  # the year of the schema version
+
+def get_schema_paths(version_year):
+  """Return xpaths, including the officer salary xpath, for a schema version."""
+  if version_year < 2013:
+    paths = dict(OLD_PATHS)
+    paths[OFFICERS_KEY] = OFFICER_PATHS['old']
+  else:
+    paths = dict(NEW_PATHS)
+    paths[OFFICERS_KEY] = OFFICER_PATHS['new']
+  # dealing with xpath issue for 2013
+  if version_year == 2013:
+    paths['organization_name'] = paths['organization_name'][:-3]
+  return paths
+
+
+@functools.lru_cache(maxsize=None)
+def get_path_tree(schema, namespace, keys=None):
+  """Compile xpaths for a schema ('old', '2013', or 'new') once.
+
+  If keys is a tuple, only the xpaths of those columns are compiled."""
+  version_year = {'old': 2012, '2013': 2013, 'new': 2014}[schema]
+  paths = get_schema_paths(version_year)
+  if keys is not None:
+    if set(keys) & set(OFFICERS):
+      keys += (OFFICERS_KEY,)
+    paths = {k: p for k, p in paths.items() if k in keys}
+  return compile_paths(paths, namespace, collect=(OFFICERS_KEY,))
+
+
+def select_path_tree(attrib, nsmap, keys=None):
+  """Pick the compiled xpaths matching the schema version of the root."""
   try:
-    version_year = int(root.attrib['returnVersion'].split('v')[0])
+    version_year = get_version_year(attrib)
   except KeyError as e:
-    print('Could not find schema version for XML tree below.')
-    print(root)
+    print('Could not find schema version for XML tree with attributes below.')
+    print(dict(attrib))
     raise e
 
   if version_year < 2013:
-    paths = OLD_PATHS
+    schema = 'old'
+  elif version_year == 2013:
+    schema = '2013'
   else:
-    paths = NEW_PATHS
+    schema = 'new'
+  return get_path_tree(schema, default_namespace(nsmap), keys)
 
-  for k, p in paths.items():
 
-    try:
-      # dealing with xpath issue for 2013
-      if version_year == 2013 and k == 'organization_name':
-        p = p[:-3]  # removing the Txt from the trail
-      data[k] = root.find(p, namespaces=root.nsmap).text
-    except AttributeError:
-      data[k] = 0  # can easily be cast to int, float, str, bool
-  salaries = parse_officers(root, version_year)
-  data.update(salaries)
+def parse(xml, streaming=False, keys=None):
+  """Grab values from xml based on xpath_headers.
+
+  If streaming, values are matched from parser events and the XML tree is
+  never built, keeping memory flat for filings with long attachments. The
+  xml can then also be a file object. If keys is given, only those columns
+  are extracted."""
+  if keys is None:
+    select = select_path_tree
+    columns = NEW_PATHS
+  else:
+    keys = tuple(keys)
+    select = functools.partial(select_path_tree, keys=keys)
+    columns = [k for k in keys if k in NEW_PATHS]
+
+  if streaming:
+    found, collected = stream_extract(xml, select)
+  else:
+    root = etree.XML(xml)
+    tree = select(root.attrib, root.nsmap)
+    found, collected = extract(root, tree)
+
+  # 0 can easily be cast to int, float, str, bool
+  data = {k: found.get(k, 0) for k in columns}
+  if OFFICERS_KEY in collected:
+    salaries = [int(s) for s in collected[OFFICERS_KEY]]
+    data.update(top_salaries(salaries))
   return data
 
 
 def parse_officers(root, version_year):
   """Grab officer information from the xml tree."""
+  schema = 'old' if version_year < 2013 else 'new'
+  salaries = root.findall(OFFICER_PATHS[schema], namespaces=root.nsmap)
+  salaries = [int(s.text) for s in salaries]
+  return top_salaries(salaries)
 
-  p = 'ReturnData/IRS990/Form990PartVIISectionA'
-  if version_year < 2013:
-    p += '/ReportableCompFromOrganization'
-  else:
-    p += 'Grp/ReportableCompFromOrgAmt'
 
-  salaries = root.findall(p, namespaces=root.nsmap)
-  salaries = [int(s.text) for s in salaries]
-  salaries.sort(reverse=True)
+def top_salaries(salaries):
+  """Skim off top salaries and pad the rest with 0."""
+  salaries = sorted(salaries, reverse=True)
   salaries = salaries[:len(OFFICERS)]
-  # skimming off top salaries
   n_pad = len(OFFICERS) - len(salaries)
   if n_pad > 0:
-    salaries += [0] * n_pad  # padding rest with 0
+    salaries += [0] * n_pad
   return dict(zip(OFFICERS, salaries))
 
 
@@ -92,108 +145,379 @@ def verify(data, org):
     print(org)
 
 
-def save_as_csv(data, filepath):
-  """Cast data to correct type and save as csv."""
-  df = pd.DataFrame(data)
-  types = {'int': int, 'str': str, 'float': float,
-           'bool': lambda x: 1 if x in ('1', 'true') else 0}
-  for k in df.columns:
-    type_as_string = DATA_TYPES[k]
-    type_literal = types[type_as_string]
-    if type_as_string == 'bool':
-      df[k] = df[k].apply(type_literal)
-    else:
-      df[k] = df[k].astype(type_literal)
-
-  df.to_csv(filepath, index=False)
-
-
-def bundle_year(year):
-  """Bundle all batched csv from year into a single csv."""
-  print('Bundling csv files into single file')
-  path = os.path.join(get_data_path(), str(year))
-  batches = os.listdir(path)
-  batches.sort()
-  batches = [os.path.join(path, batch) for batch in batches]
-  batch_dfs = [pd.read_csv(batch) for batch in batches]
-  df = pd.concat(batch_dfs)
-  csv_path = os.path.join(path, str(year) + '.csv')
-  print(f'Saving new csv as {csv_path}')
-  df.to_csv(csv_path, index=False)
+def parse_filing(xml, org, streaming=False, keys=None):
+  """Parse and verify raw xml for org, returning empty data for 404s.
 
+  This is the unit of work handed to parser processes by the scraper. When
+  only some keys are extracted, verification is left to the caller."""
+  if xml is None:
+    if keys is not None:
+      keys = [k for k in keys if k in DATA_TYPES]
+    return empty_data(keys)
+  data = parse(xml, streaming, keys)
+  if keys is None:
+    verify(data, org)
+  return cast_row(data)
+
+
+def timed_parse_filing(xml, org, streaming=False, keys=None):
+  """Run parse_filing, also returning seconds spent in parse and verify."""
+  if xml is None:
+    return parse_filing(xml, org, streaming, keys), {}
+  start = time.perf_counter()
+  data = cast_row(parse(xml, streaming, keys))
+  parsed = time.perf_counter()
+  if keys is None:
+    verify(data, org)
+  return data, {'parse': parsed - start, 'verify': time.perf_counter() - parsed}
+
+
+TRUE_VALUES = ('1', 'true', 1)  # 1 for booleans already cast by cast_row
+
+
+def cast_value(value, data_type):
+  """Cast a single parsed value to data_type as cast_column does."""
+  if data_type == 'bool':
+    return 1 if value in TRUE_VALUES else 0
+  if data_type == 'str':
+    return str(value)
+  if data_type == 'int':
+    try:
+      return int(value)
+    except (TypeError, ValueError):
+      pass
+  try:
+    number = float(value)
+    if number != number:  # nan, left out as to_numeric does
+      raise ValueError
+    return int(number) if data_type == 'int' else number
+  except (TypeError, ValueError, OverflowError):
+    return 0 if data_type == 'int' else 0.0
+
+
+def cast_row(data):
+  """Cast every value of a parsed row to its data type.
+
+  Parser processes cast the rows they return, so to_frame only has to
+  gather values already of the right type into columns."""
+  return {k: cast_value(v, DATA_TYPES[k]) for k, v in data.items()}
+
+
+def cast_column(values, data_type):
+  """Cast a sequence of parsed values to data_type with vectorized steps.
+
+  Booleans are 1 for '1' or 'true' and 0 otherwise. Numbers which cannot be
+  parsed, such as empty elements, become 0. Values already cast by cast_row
+  are kept, taking the fast path."""
+  s = pd.Series(values, dtype=object)
+  if data_type == 'bool':
+    return s.isin(TRUE_VALUES).astype('int64')
+  if data_type == 'str':
+    return s.astype(str)
+  dtype = 'int64' if data_type == 'int' else 'float64'
+  try:
+    return s.astype(dtype)  # fast path when every value is clean
+  except (TypeError, ValueError):
+    numbers = pd.to_numeric(s, errors='coerce').fillna(0)
+    return numbers.astype(dtype)
+
+
+def to_frame(rows):
+  """Build a typed DataFrame from parsed rows.
+
+  The rows are transposed into columns in a single pass. Rows cast by
+  cast_row, as returned by parse_filing, are gathered without parsing any
+  strings; raw rows from parse are cast here."""
+  if not rows:
+    return pd.DataFrame()
+  keys = list(rows[0])
+  if len(keys) == 1:  # itemgetter of a single key returns the bare value
+    values = [[row[keys[0]] for row in rows]]
+  else:
+    values = zip(*map(operator.itemgetter(*keys), rows))
+  columns = {k: cast_column(v, DATA_TYPES[k]) for k, v in zip(keys, values)}
+  return pd.DataFrame(columns)
+
+
+def get_fingerprints():
+  """Return a short hash of the xpaths and data type behind each column."""
+  fingerprints = {}
+  for _, row in XP.iterrows():
+    spec = '|'.join([row['old_xpath'], row['new_xpath'], row['data_type']])
+    fingerprints[row['key']] = hashlib.sha1(spec.encode()).hexdigest()[:12]
+  spec = '|'.join([OFFICER_PATHS['old'], OFFICER_PATHS['new'], 'int'])
+  for k in OFFICERS:
+    fingerprints[k] = hashlib.sha1(spec.encode()).hexdigest()[:12]
+  return fingerprints
+
+
+def get_fingerprint_path(year):
+  """Return path of the json recording the xpaths year was extracted with."""
+  return os.path.join(get_data_path(), str(year), 'xpaths.json')
 
-def confirm_year(year):
-  """Confirm index and bundled csv have the same number of entries."""
-  csv_path = os.path.join(get_data_path(), str(year), str(year) + '.csv')
-  index_path = os.path.join(get_data_path(), 'index',
-                            'index_' + str(year) + '.json')
 
-  df = pd.read_csv(csv_path)
-  with open(index_path) as f:
-    index = json.load(f)
+def save_fingerprints(year, fingerprints=None):
+  """Record the fingerprint of each column saved for year."""
+  if fingerprints is None:
+    fingerprints = get_fingerprints()
+  with open(get_fingerprint_path(year), 'w') as f:
+    json.dump(fingerprints, f, indent=2)
 
-  if len(df) != len(index):
-    raise ValueError(f'len(df) = {len(df)} whereas len(index) = {len(index)}')
 
-  print(f'Successfully fetched {len(df)} tax forms from {year}')
+def load_fingerprints(year):
+  """Return fingerprints recorded for year, or None for older datasets."""
+  if not os.path.exists(path := get_fingerprint_path(year)):
+    return None
+  with open(path) as f:
+    return json.load(f)
+
+
+def confirm_year(year):
+  """Confirm index and bundled csv have the same number of entries.
+
+  When the csv was written with a manifest, only the manifest and the size
+  of the csv are checked instead of reading the csv again."""
+  csv_path = os.path.join(get_data_path(), str(year), str(year) + '.csv')
+  n_index = count_index(year)
+
+  if (manifest := load_manifest(year)) is not None:
+    if not manifest['complete']:
+      raise ValueError(f'Data from {year} was never committed.')
+    if (size := os.path.getsize(csv_path)) != manifest['bytes']:
+      raise ValueError(f'{csv_path} has {size} bytes whereas the manifest '
+                       f'records {manifest["bytes"]}.')
+    n_rows = manifest['rows']
+  else:
+    n_rows = len(pd.read_csv(csv_path))
 
+  if n_rows != n_index:
+    raise ValueError(f'len(df) = {n_rows} whereas len(index) = {n_index}')
 
-def clean_year(year):
-  """Remove csv batches after bundling."""
-  path = os.path.join(get_data_path(), str(year))
-  batches = os.listdir(path)
-  batches.sort()
-  bundle = str(year) + '.csv'
-  assert bundle in batches
-  batches = [os.path.join(path, batch) for batch in batches if batch != bundle]
-  for batch in batches:
-    os.remove(batch)
+  print(f'Successfully fetched {n_rows} tax forms from {year}')
 
 
-def load_data(year=None):
-  """Return DataFrame containing 990 data from specified year."""
+def load_data(year=None, columns=None, filters=None, compact=False):
+  """Return DataFrame containing 990 data from specified year.
+
+  Years saved as parquet read only the requested columns and the row groups
+  passing filters, a list of (column, op, value) tuples. Other years fall
+  back to csv. The columns ein and tax_year are always included. If compact,
+  each year is shrunk with compact_dtypes as it is loaded."""
   years = get_index_years()
   if year is not None:
     if not year in years:
       raise ValueError('Check the parameter year.')
     years = [year]
+  if columns is not None:
+    columns = list(dict.fromkeys(['ein', 'tax_year'] + list(columns)))
 
   dfs = []
+  n_bytes = 0
   for y in years:
-    path = os.path.join(get_data_path(), str(y), str(y) + '.csv')
-    if os.path.exists(path):
-      print(f'Loading data from {y} ...')
-      df = pd.read_csv(path)
-      dfs.append(df)
-    else:
-      raise FileNotFoundError(f'Could not find CSV data from {y}.')
+    df = read_snapshot(y, columns, filters)
+    if compact:
+      n_bytes += df.memory_usage(deep=True).sum()
+      df = compact_dtypes(df)
+    dfs.append(df)
   df = pd.concat(dfs)
   print(f'Successfully loaded data from {len(df)} tax forms.')
-  df = fix_mistakes(df)
+  if compact:
+    df = compact_dtypes(df)  # categories differing across years become objects
+    n_compact = df.memory_usage(deep=True).sum()
+    print(f'Memory footprint: {n_bytes / 2 ** 20:.1f}MB as loaded, '
+          f'{n_compact / 2 ** 20:.1f}MB compacted.')
+  # the same tax year can be filed again in a later index year
+  print('Keeping most recent tax form per organization across years ...')
+  df = dedup(df)
   print(f'After cleaning, data from {len(df)} tax forms remain.')
 
   return df
 
 
+def iter_data(years=None, columns=None, filters=None, chunksize=100000,
+              compact=False):
+  """Yield cleaned data in typed chunks of at most chunksize rows, year by year.
+
+  The rows are those of load_data with the same arguments, without holding
+  more than one chunk in memory. Repeated forms within a year are already
+  removed in its snapshot; for a tax year filed again in a later index year,
+  only the row from the latest year is yielded. The ein and tax_year of
+  every year are read first to find those rows."""
+  all_years = get_index_years()
+  years = all_years if years is None else list(years)
+  if set(years) - set(all_years):
+    raise ValueError('Check the parameter years.')
+  if not years:
+    return
+  if columns is not None:
+    columns = list(dict.fromkeys(['ein', 'tax_year'] + list(columns)))
+
+  # marking rows superseded by a later year, as dedup does after concat
+  keys = [read_snapshot(y, ['ein', 'tax_year'], filters) for y in years]
+  ein = np.concatenate([k['ein'].to_numpy() for k in keys])
+  tax_year = np.concatenate([k['tax_year'].to_numpy() for k in keys])
+  order = np.lexsort((ein, tax_year))
+  ein, tax_year = ein[order], tax_year[order]
+  last = np.ones(len(order), dtype=bool)
+  last[:-1] = (ein[1:] != ein[:-1]) | (tax_year[1:] != tax_year[:-1])
+  keep = np.zeros(len(order), dtype=bool)
+  keep[order[last]] = True
+  keeps = np.split(keep, np.cumsum([len(k) for k in keys])[:-1])
+  del keys, ein, tax_year, order, last, keep
+
+  # scanning with the expression read_snapshot filters by, so the rows and
+  # their order match the masks, and row groups are skipped by statistics
+  expression = None if not filters else pq.filters_to_expression(filters)
+  for y, keep in zip(years, keeps):
+    offset = 0
+    dataset = ds.dataset(get_snapshot_path(y), format='parquet')
+    for batch in dataset.to_batches(columns=columns, filter=expression,
+                                    batch_size=chunksize):
+      mask = keep[offset: offset + batch.num_rows]
+      offset += batch.num_rows
+      df = batch.filter(pa.array(mask)).to_pandas()
+      if compact:
+        df = compact_dtypes(df)
+      if len(df):
+        yield df
+
+
+def read_year(year, columns=None, filters=None):
+  """Return typed data saved for year, from parquet or else from csv."""
+  path = os.path.join(get_data_path(), str(year), str(year) + '.csv')
+  if storage.has_year(year):
+    print(f'Loading parquet data from {year} ...')
+    return storage.read_years([year], columns, filters)
+  if not os.path.exists(path):
+    raise FileNotFoundError(f'Could not find CSV data from {year}.')
+  print(f'Loading data from {year} ...')
+  usecols = columns
+  if columns is not None:
+    usecols = columns + [f[0] for f in filters or [] if f[0] not in columns]
+  df = storage.apply_filters(pd.read_csv(path, usecols=usecols), filters)
+  if columns is not None:
+    df = df[columns]
+  # typing csv data the same way as parquet data
+  return storage.to_table(df).to_pandas()
+
+
+def get_snapshot_path(year):
+  """Return path of the cleaned snapshot of year."""
+  return os.path.join(get_data_path(), 'clean', f'{year}.parquet')
+
+
+def get_source_signature(year):
+  """Describe the saved data of year by the size and mtime of its files.
+
+  The sha1 of the manifest, which holds a checksum of every batch, is
+  included as well so rewritten data with an unchanged size is noticed."""
+  paths = storage.get_parts(year)
+  if not paths:
+    paths = [os.path.join(get_data_path(), str(year), f'{year}.csv')]
+  files = []
+  for path in paths:
+    stat = os.stat(path)
+    files.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+  manifest = None
+  if os.path.exists(manifest_path := get_manifest_path(year)):
+    with open(manifest_path, 'rb') as f:
+      manifest = hashlib.sha1(f.read()).hexdigest()
+  return {'version': SNAPSHOT_VERSION, 'files': files, 'manifest': manifest}
+
+
+def save_snapshot(year):
+  """Clean the data of year with fix_mistakes and save it as a snapshot."""
+  signature = get_source_signature(year)
+  df = fix_mistakes(read_year(year))
+  table = pa.Table.from_pandas(df, preserve_index=False)
+  table = table.replace_schema_metadata(
+      {**(table.schema.metadata or {}), b'source': json.dumps(signature)})
+  path = get_snapshot_path(year)
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  pq.write_table(table, path + '.tmp', compression='zstd')
+  os.replace(path + '.tmp', path)
+  return df
+
+
+def snapshot_is_current(year):
+  """Determine if the snapshot of year was built from its current data."""
+  if not os.path.exists(path := get_snapshot_path(year)):
+    return False
+  metadata = pq.read_schema(path).metadata or {}
+  if b'source' not in metadata:
+    return False
+  return json.loads(metadata[b'source']) == get_source_signature(year)
+
+
+def read_snapshot(year, columns=None, filters=None):
+  """Return cleaned data of year, rebuilding its snapshot when stale."""
+  if not snapshot_is_current(year):
+    print(f'Cleaning data from {year} ...')
+    save_snapshot(year)
+  print(f'Loading cleaned data from {year} ...')
+  expression = None if not filters else pq.filters_to_expression(filters)
+  table = pq.read_table(get_snapshot_path(year), columns=columns,
+                        filters=expression)
+  return table.to_pandas()
+
+
+def compact_dtypes(df):
+  """Shrink columns of df to compact dtypes chosen from DATA_TYPES.
+
+  Booleans become uint8, integers take the smallest signed width holding
+  their values, and floats become float32. Header text, such as names which
+  repeat across years, becomes categorical while other text is stored as
+  arrow backed strings."""
+  categories = dict(zip(XP['key'], XP['category']))
+  for k in df.columns:
+    data_type = DATA_TYPES.get(k)
+    s = df[k]
+    if data_type == 'bool':
+      df[k] = s.astype('uint8')
+    elif pd.api.types.is_integer_dtype(s):
+      df[k] = pd.to_numeric(s, downcast='integer')
+    elif pd.api.types.is_float_dtype(s):
+      df[k] = s.astype('float32')
+    elif categories.get(k) == 'header':
+      if not isinstance(s.dtype, pd.CategoricalDtype):
+        df[k] = s.astype('category')
+    elif data_type == 'str':
+      df[k] = s.astype('string[pyarrow]')
+  return df
+
+
 def fix_mistakes(df):
   """Correct obvious mistakes in 990 data."""
   # converting nan missions to empty strings
-  print('Converting null missions to empty strings ...')
-  df['mission'] = df['mission'].fillna('')
+  if 'mission' in df.columns:
+    print('Converting null missions to empty strings ...')
+    df['mission'] = df['mission'].fillna('')
 
   # dealing with 404 errors arrising from outdated index files in early years
   df = df[df['ein'] != 0]  # to deal with 404s from early years
 
-  if s := sum(df['organization_name'] == '0'):
-    ValueError(f'Found {s} organizations without a name!')
+  if 'organization_name' in df.columns:
+    if s := sum(df['organization_name'] == '0'):
+      ValueError(f'Found {s} organizations without a name!')
 
   # some organizations have repeated tax forms in a given year
   # only keep most recently submitted form
   print('Keeping most recent tax form per organization per year ...')
-  df = df.groupby(['ein', 'tax_year']).last().reset_index()
-  print('Sorting data by tax year ...')
-  df = df.sort_values('tax_year')
-  return df.reset_index(drop=True)
+  return dedup(df)
+
+
+def dedup(df):
+  """Keep the last row of each (ein, tax_year), sorted by tax_year and ein.
+
+  A stable sort on the keys keeps duplicates in their original order, so the
+  last row of each run of equal keys is the most recently submitted form."""
+  ein = df['ein'].to_numpy()
+  tax_year = df['tax_year'].to_numpy()
+  order = np.lexsort((ein, tax_year))
+  ein, tax_year = ein[order], tax_year[order]
+  last = np.ones(len(order), dtype=bool)
+  last[:-1] = (ein[1:] != ein[:-1]) | (tax_year[1:] != tax_year[:-1])
+  return df.take(order[last]).reset_index(drop=True)
 
 
 def get_boolean_keys():
@@ -0,0 +1,152 @@
+"""Append finished batches straight into the final files of a year."""
+
+import os
+import json
+import hashlib
+from nine_ninety.scrape import storage
+from nine_ninety.scrape.index import get_data_path
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def get_manifest_path(year):
+  """Return path of the manifest describing the csv of year."""
+  return os.path.join(get_data_path(), str(year), MANIFEST_NAME)
+
+
+def load_manifest(year):
+  """Return the manifest of year, or None if it was never written."""
+  if not os.path.exists(path := get_manifest_path(year)):
+    return None
+  with open(path) as f:
+    return json.load(f)
+
+
+def save_manifest(year, manifest):
+  """Atomically replace the manifest of year."""
+  path = get_manifest_path(year)
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump(manifest, f, indent=2)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp_path, path)
+
+
+def year_is_committed(year):
+  """Determine if the data of year was committed.
+
+  Datasets written before manifests existed count as committed if their csv
+  exists; otherwise the manifest must have been marked complete."""
+  if (manifest := load_manifest(year)) is None:
+    path = os.path.join(get_data_path(), str(year), f'{year}.csv')
+    return os.path.exists(path)
+  return manifest['complete']
+
+
+def new_manifest():
+  """Return a manifest without any batches."""
+  return {'rows': 0, 'bytes': 0, 'complete': False, 'batches': {}}
+
+
+def write_file_manifest(year, n_rows):
+  """Record the csv of year, rewritten outside of a YearWriter, as one batch."""
+  path = os.path.join(get_data_path(), str(year), f'{year}.csv')
+  with open(path, 'rb') as f:
+    blob = f.read()
+  manifest = new_manifest()
+  manifest['batches']['0'] = {'rows': n_rows, 'offset': 0, 'length': len(blob),
+                              'sha1': hashlib.sha1(blob).hexdigest()}
+  manifest.update(rows=n_rows, bytes=len(blob), complete=True)
+  save_manifest(year, manifest)
+
+
+class YearWriter:
+  """Append batches of a year into its final csv and parquet data.
+
+  Each batch is appended to <year>.csv.partial and written as a staged
+  parquet part. The manifest then records its rows, byte range and sha1 and
+  is atomically replaced, so a crash loses at most the batch in progress.
+  Batches must arrive in index order; commit moves both files into place."""
+
+  def __init__(self, year, overwrite=False):
+    self.year = year
+    path = os.path.join(get_data_path(), str(year))
+    if not os.path.exists(path):
+      os.mkdir(path)
+    self.csv_path = os.path.join(path, f'{year}.csv')
+    self.partial_path = self.csv_path + '.partial'
+
+    self.manifest = load_manifest(year)
+    if overwrite or self.manifest is None or self.manifest['complete']:
+      self.manifest = new_manifest()
+      if os.path.exists(self.partial_path):
+        os.remove(self.partial_path)
+      storage.clear_staging(year)
+      save_manifest(year, self.manifest)
+
+    # discarding bytes of a batch interrupted before the manifest was saved
+    if os.path.exists(self.partial_path):
+      if os.path.getsize(self.partial_path) > self.manifest['bytes']:
+        os.truncate(self.partial_path, self.manifest['bytes'])
+    elif self.manifest['bytes'] and not self.csv_is_moved():
+      raise FileNotFoundError(f'{self.partial_path} is missing.')
+
+  def csv_is_moved(self):
+    """Determine if an interrupted commit already moved the csv into place."""
+    return (os.path.exists(self.csv_path) and
+            os.path.getsize(self.csv_path) == self.manifest['bytes'])
+
+  @property
+  def batches(self):
+    """Numbers of the batches already written."""
+    return sorted(int(n) for n in self.manifest['batches'])
+
+  def append(self, n_batch, df):
+    """Append the typed DataFrame of a batch."""
+    if n_batch != (expected := len(self.manifest['batches'])):
+      raise ValueError(f'Expected batch {expected} but received {n_batch}.')
+
+    offset = self.manifest['bytes']
+    blob = df.to_csv(index=False, header=offset == 0).encode()
+    with open(self.partial_path, 'ab') as f:
+      f.write(blob)
+      f.flush()
+      os.fsync(f.fileno())
+    storage.write_part(df, self.year, n_batch, staging=True)
+
+    self.manifest['batches'][str(n_batch)] = {
+        'rows': len(df), 'offset': offset, 'length': len(blob),
+        'sha1': hashlib.sha1(blob).hexdigest()}
+    self.manifest['rows'] += len(df)
+    self.manifest['bytes'] += len(blob)
+    save_manifest(self.year, self.manifest)
+
+  def commit(self, n_expected=None):
+    """Move the parquet parts and then the appended csv into place.
+
+    The manifest is marked complete last, so a commit interrupted at any
+    step is finished by the next commit."""
+    if n_expected is not None and self.manifest['rows'] != n_expected:
+      raise ValueError(f'Wrote {self.manifest["rows"]} rows '
+                       f'whereas the index has {n_expected}.')
+    if os.path.exists(storage.get_parquet_dir(self.year, staging=True)):
+      storage.commit_parts(self.year, len(self.manifest['batches']))
+    if os.path.exists(self.partial_path):
+      os.replace(self.partial_path, self.csv_path)
+    self.manifest['complete'] = True
+    save_manifest(self.year, self.manifest)
+
+
+def verify_manifest(year):
+  """Check the csv of year against every checksum in its manifest."""
+  manifest = load_manifest(year)
+  path = os.path.join(get_data_path(), str(year), f'{year}.csv')
+  with open(path, 'rb') as f:
+    for n, batch in manifest['batches'].items():
+      f.seek(batch['offset'])
+      blob = f.read(batch['length'])
+      if hashlib.sha1(blob).hexdigest() != batch['sha1']:
+        raise ValueError(f'Checksum of batch {n} from {year} does not match!')
+  print(f'Verified {len(manifest["batches"])} batches from {year}.')
@@ -13,6 +13,7 @@ install_requires = [
     'tensorflow',
     'scikit_learn',
     'lxml',
+    'pyarrow',
     'requests',
     'aiohttp']
 